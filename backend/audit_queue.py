@@ -0,0 +1,81 @@
+# backend/audit_queue.py
+# Fire-and-forget sink for audit/log docs.
+# Request handlers enqueue() and return immediately; a daemon thread drains the
+# queue and commits up to MAX_BATCH docs per WriteBatch (every FLUSH_INTERVAL s).
+from __future__ import annotations
+import atexit
+import logging
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from backend.client import db  # type: ignore
+
+COL_AUDIT = "activity_logs"
+MAX_BATCH = 400
+FLUSH_INTERVAL = 0.1  # seconds
+
+log = logging.getLogger(__name__)
+
+_Item = Tuple[str, Dict[str, Any]]
+_q: "queue.Queue[_Item]" = queue.Queue(maxsize=10_000)
+_worker: Optional[threading.Thread] = None
+_worker_lock = threading.Lock()
+
+def _commit(items: List[_Item]) -> None:
+    batch = db.batch()  # type: ignore
+    for col, doc in items:
+        batch.set(db.collection(col).document(), doc)  # type: ignore
+    try:
+        batch.commit()
+    except Exception:
+        log.exception("audit_queue: dropped %d docs after failed commit", len(items))
+
+def _run() -> None:
+    while True:
+        items = [_q.get()]
+        deadline = time.monotonic() + FLUSH_INTERVAL
+        while len(items) < MAX_BATCH:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(_q.get(timeout=remaining))
+            except queue.Empty:
+                break
+        _commit(items)
+
+def _ensure_worker() -> None:
+    # Started lazily (and restarted if dead) so a pre-forking server
+    # (gunicorn preload_app) gets a live worker in every child process.
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run, name="audit-queue", daemon=True)
+            _worker.start()
+
+def enqueue(doc: Dict[str, Any], collection: str = COL_AUDIT) -> None:
+    """Queue `doc` for a new auto-ID document in `collection`."""
+    _ensure_worker()
+    try:
+        _q.put_nowait((collection, doc))
+    except queue.Full:
+        # Never drop audit records under backpressure; pay the RPC inline instead.
+        db.collection(collection).document().set(doc)  # type: ignore
+
+@atexit.register
+def flush() -> None:
+    """Synchronously commit whatever is still queued (used at interpreter exit)."""
+    items: List[_Item] = []
+    while True:
+        try:
+            items.append(_q.get_nowait())
+        except queue.Empty:
+            break
+        if len(items) == MAX_BATCH:
+            _commit(items)
+            items = []
+    if items:
+        _commit(items)
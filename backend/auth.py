@@ -0,0 +1,22 @@
+# backend/auth.py
+# Shared "Authorization: Bearer <idToken>" handling for the blueprints.
+# Helpers raise (ValueError / firebase auth errors); routes map that to 401.
+from __future__ import annotations
+from typing import Any, Dict
+from flask import request
+from backend.auth_cache import verify_cached
+
+_BEARER = "Bearer "
+_BEARER_LEN = len(_BEARER)
+
+def bearer_token() -> str:
+    authz = request.headers.get("Authorization", "")
+    if not authz.startswith(_BEARER):
+        raise ValueError("Missing or invalid Authorization header")
+    return authz[_BEARER_LEN:]  # slice, no split() list allocation
+
+def require_decoded_token() -> Dict[str, Any]:
+    return verify_cached(bearer_token())
+
+def require_uid() -> str:
+    return require_decoded_token()["uid"]
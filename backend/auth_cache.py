@@ -0,0 +1,45 @@
+# backend/auth_cache.py
+from __future__ import annotations
+import hashlib
+import os
+import threading
+import time
+from typing import Any, Dict
+
+from cachetools import TTLCache
+from firebase_admin import auth as fb_auth
+from backend.jwt_verify import verify_firebase_id_token
+
+# Decoded ID-token claims, keyed by a truncated sha256 of the raw token so the
+# bearer string itself is never kept in memory longer than the request.
+_TTL_SECONDS = 30
+_EXP_SKEW_SECONDS = 2
+
+_tok_cache: TTLCache = TTLCache(maxsize=10_000, ttl=_TTL_SECONDS)
+_lock = threading.RLock()
+
+def _cache_key(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()[:16]
+
+def verify_cached(token: str) -> Dict[str, Any]:
+    """
+    Drop-in for fb_auth.verify_id_token(token).
+    Repeat calls with the same token within the TTL (and before the token's own
+    `exp`) return the previously verified claims without re-checking the signature.
+    """
+    key = _cache_key(token)
+    now = time.time()
+    with _lock:
+        hit = _tok_cache.get(key)
+    if hit is not None:
+        decoded, expires_at = hit
+        if expires_at > now + _EXP_SKEW_SECONDS:
+            return decoded
+
+    if os.getenv("FIREBASE_AUTH_EMULATOR_HOST"):
+        decoded = fb_auth.verify_id_token(token)  # emulator tokens are unsigned
+    else:
+        decoded = verify_firebase_id_token(token)
+    with _lock:
+        _tok_cache[key] = (decoded, min(decoded["exp"], now + _TTL_SECONDS))
+    return decoded
@@ -0,0 +1,27 @@
+# backend/batching.py
+# One way to commit multi-doc mutations: each op adds itself to a WriteBatch,
+# and the batch is committed every BATCH_LIMIT ops (Firestore's per-commit cap),
+# so N writes cost ceil(N/500) round-trips instead of N.
+from __future__ import annotations
+from typing import Any, Callable, Iterable, List
+from backend.client import db  # type: ignore
+
+BATCH_LIMIT = 500
+
+BatchOp = Callable[[Any], None]  # receives the WriteBatch, e.g. lambda b: b.set(ref, data)
+
+def commit_batched(ops: Iterable[BatchOp]) -> List[Any]:
+    """Apply `ops` in order; returns the WriteResults of every commit, in op order."""
+    results: List[Any] = []
+    batch = db.batch()  # type: ignore
+    pending = 0
+    for op in ops:
+        op(batch)
+        pending += 1
+        if pending == BATCH_LIMIT:
+            results.extend(batch.commit())
+            batch = db.batch()  # type: ignore
+            pending = 0
+    if pending:
+        results.extend(batch.commit())
+    return results
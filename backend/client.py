@@ -1,15 +1,66 @@
+import logging
 import os
-import firebase_admin
-from firebase_admin import credentials, firestore
+import threading
+from functools import cache
+from google.cloud.firestore_v1 import SERVER_TIMESTAMP
+from werkzeug.local import LocalProxy
 
+# Firebase Admin and the Firestore client (credential load + gRPC channel) are
+# created on first use rather than at import, so cold start only pays for them
+# when a request needs Firestore, and a pre-forking server builds the channel
+# in each worker instead of sharing one across fork().
+_db = None
+_db_lock = threading.Lock()
 
-cred_path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
-if not cred_path:
-    raise RuntimeError("GOOGLE_APPLICATION_CREDENTIALS env var not set.")
+PROJECT_ID = os.getenv("FIREBASE_PROJECT_ID", "loopy-productivity-app")
 
-if not firebase_admin._apps:
-    cred = credentials.Certificate(cred_path)
-    firebase_admin.initialize_app(cred)
+# Resolved once at import: which credential source to use (the path checks are
+# the only filesystem work here; nothing is loaded until first use).
+_GCRED = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+_USE_ADC = bool(_GCRED and os.path.exists(_GCRED))
+_SA_PATH = os.getenv("FIREBASE_SERVICE_ACCOUNT", "serviceAccount.json")
 
-db = firestore.client()
-SERVER_TS = firestore.SERVER_TIMESTAMP
+def _init_firebase_admin():
+    import firebase_admin
+    from firebase_admin import credentials
+    if firebase_admin._apps:
+        return
+    if _USE_ADC:
+        # Explicitly specify project ID even with env var
+        firebase_admin.initialize_app(credentials.ApplicationDefault(), {
+            'projectId': PROJECT_ID
+        })
+    else:
+        if not os.path.exists(_SA_PATH):
+            raise RuntimeError(
+                "Firebase Admin needs credentials. Set GOOGLE_APPLICATION_CREDENTIALS "
+                "to a service account JSON, or provide FIREBASE_SERVICE_ACCOUNT path."
+            )
+        firebase_admin.initialize_app(credentials.Certificate(_SA_PATH))
+
+def get_db():
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                from firebase_admin import firestore
+                _init_firebase_admin()
+                _db = firestore.client()
+    return _db
+
+def warm_db():
+    """
+    Build the client and make one cheap read, so channel setup (TLS, HTTP/2)
+    and the first auth-token fetch happen before a request needs them.
+    """
+    try:
+        get_db().collection("_warmup").document("ping").get(timeout=10)
+    except Exception:
+        logging.getLogger(__name__).warning("Firestore warmup failed", exc_info=True)
+
+def lazy(factory):
+    """Proxy for a value built from `db` on first access (e.g. collection refs)."""
+    return LocalProxy(cache(factory))
+
+db = LocalProxy(get_db)
+SERVER_TS = SERVER_TIMESTAMP
@@ -1,23 +1,32 @@
 # backend/crud/admin_analytics.py
 from __future__ import annotations
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Set, Tuple
 from flask import Blueprint, request, jsonify, current_app, Response
-from firebase_admin import auth as fb_auth
+from backend import audit_queue
+from backend.auth import require_decoded_token
 from google.cloud.firestore_v1.base_query import FieldFilter  # type: ignore
 from backend.client import db, SERVER_TS  # type: ignore
+from backend.crud.rollups import USERS_ROLLUP, TASKS_ROLLUP, day_key
+
+try:
+    import ciso8601  # C parser for RFC 3339 timestamps
+except ImportError:  # pragma: no cover - optional speedup
+    ciso8601 = None  # type: ignore
 
 bp = Blueprint("admin_analytics", __name__, url_prefix="/admin/analytics")
 
+# The count()/rollup queries in each summary are independent RPCs; run them
+# side by side so a summary costs max(latency) rather than the sum.
+_POOL = ThreadPoolExecutor(max_workers=6, thread_name_prefix="admin-analytics")
+
 def _err(msg: str, code: int) -> Tuple[Response, int]:
     return jsonify({"error": msg}), code
 
 def _require_decoded_token() -> Dict[str, Any]:
-    authz = request.headers.get("Authorization", "")
-    if not authz.startswith("Bearer "):
-        raise ValueError("Missing or invalid Authorization header")
-    token = authz.split(" ", 1)[1]
-    return fb_auth.verify_id_token(token)
+    return require_decoded_token()
 
 def _require_scope(decoded: Dict[str, Any], scope: str) -> None:
     role = decoded.get("role") or decoded.get("claims", {}).get("role")
@@ -26,8 +35,16 @@ def _require_scope(decoded: Dict[str, Any], scope: str) -> None:
         raise PermissionError(f"Admin with {scope} scope required")
 
 def _iso_to_dt(s: str) -> datetime:
+    if ciso8601 is not None:
+        try:
+            return ciso8601.parse_rfc3339(s).astimezone(timezone.utc)
+        except ValueError:
+            pass  # not strict RFC 3339 (e.g. no offset); use the lenient parser
     return datetime.fromisoformat(s.replace("Z","+00:00")).astimezone(timezone.utc)
 
+def _count(q) -> int:
+    return q.count().get()[0][0].value  # aggregation count()
+
 def _date_range() -> Tuple[datetime, datetime]:
     since_s = request.args.get("since")  # ISO8601, e.g. 2025-08-01T00:00:00Z
     until_s = request.args.get("until")  # ISO8601
@@ -36,6 +53,54 @@ def _date_range() -> Tuple[datetime, datetime]:
     until = _iso_to_dt(until_s) if until_s else now
     return since, until
 
+def _uncovered_spans(since: datetime, until: datetime, covered: Set[str]) -> List[Tuple[datetime, datetime]]:
+    """
+    [start, end) spans of the window whose UTC days have no rollup rows (e.g.
+    days from before the rollups were written); those are scanned instead.
+    """
+    spans: List[Tuple[datetime, datetime]] = []
+    end = until + timedelta(microseconds=1)
+    day = since.replace(hour=0, minute=0, second=0, microsecond=0)
+    start = None
+    while day < end:
+        if day_key(day) in covered:
+            if start is not None:
+                spans.append((start, day))
+                start = None
+        elif start is None:
+            start = max(day, since)
+        day += timedelta(days=1)
+    if start is not None:
+        spans.append((start, end))
+    return spans
+
+def _scan_users(start: datetime, end: datetime) -> Tuple[List[str], List[str]]:
+    docs = (
+        db.collection("users")
+        .where("marketingConsent", "==", True)
+        .where("updatedAt", ">=", start)
+        .where("updatedAt", "<", end)
+        .select(["country", "ageBracket"])
+        .stream()
+    )
+    countries: List[str] = []
+    ages: List[str] = []
+    for d in docs:
+        u = d.to_dict()
+        countries.append((u.get("country") or "unknown").lower())
+        ages.append((u.get("ageBracket") or "unknown").lower())
+    return countries, ages
+
+def _scan_task_states(start: datetime, end: datetime) -> List[str]:
+    snaps = (
+        db.collection("tasks")
+        .where("updatedAt", ">=", start)
+        .where("updatedAt", "<", end)
+        .select(["state"])
+        .stream()
+    )
+    return [s.to_dict().get("state") or "unknown" for s in snaps]
+
 # ---- Users: consented counts by country/age, MAU (last 30d), total consented ----
 @bp.get("/users/summary")
 def users_summary():
@@ -52,7 +117,6 @@ def users_summary():
 
     # total consented
     consented_q = db.collection("users").where("marketingConsent", "==", True)
-    consented_count = consented_q.count().get()[0][0].value  # aggregation count()
 
     # MAU (last 30 days or since param) based on lastSignIn
     mau_q = (
@@ -61,29 +125,45 @@ def users_summary():
         .where("lastSignIn", ">=", since)
         .where("lastSignIn", "<=", until)
     )
-    mau = mau_q.count().get()[0][0].value
-
-    # breakdowns (best-effort; Firestore has no group-by—do client-side)
-    country_counts: Dict[str,int] = {}
-    age_counts: Dict[str,int] = {}
 
-    # If large volume, consider BigQuery export or a daily rollup collection.
-    docs = (
-        db.collection("users")
-        .where("marketingConsent", "==", True)
-        .where("updatedAt", ">=", since)
-        .where("updatedAt", "<=", until)
-        .stream()
+    # Days with rollup rows are read from them (O(days x groups)); days without
+    # (from before the rollup existed) fall back to scanning the users themselves.
+    rollup_q = (
+        db.collection(USERS_ROLLUP)
+        .where("consented", "==", True)
+        .where("date", ">=", day_key(since))
+        .where("date", "<=", day_key(until))
     )
-    for d in docs:
-        u = d.to_dict()
-        c = (u.get("country") or "unknown").lower()
-        a = (u.get("ageBracket") or "unknown").lower()
-        country_counts[c] = country_counts.get(c, 0) + 1
-        age_counts[a] = age_counts.get(a, 0) + 1
+
+    f_consented = _POOL.submit(_count, consented_q)
+    f_mau = _POOL.submit(_count, mau_q)
+    f_rollup = _POOL.submit(lambda: list(rollup_q.stream()))
+    consented_count = f_consented.result()
+    mau = f_mau.result()
+    rollup = f_rollup.result()
+
+    # breakdowns (best-effort; Firestore has no group-by—do client-side)
+    country_counts: Counter[str] = Counter()
+    age_counts: Counter[str] = Counter()
+
+    covered: Set[str] = set()
+    for r in rollup:
+        row = r.to_dict()
+        covered.add(row.get("date"))
+        n = int(row.get("count") or 0)
+        if not n:
+            continue
+        c, a = row.get("country") or "unknown", row.get("ageBracket") or "unknown"
+        country_counts[c] += n
+        age_counts[a] += n
+
+    for countries, ages in _POOL.map(lambda span: _scan_users(*span), _uncovered_spans(since, until, covered)):
+        # one C-level tally per field instead of a dict lookup+store per doc
+        country_counts.update(countries)
+        age_counts.update(ages)
 
     # audit
-    db.collection("activity_logs").document().set({
+    audit_queue.enqueue({
         "userId": admin_uid,
         "action": "admin.analytics.users_summary",
         "params": {"since": since.isoformat(), "until": until.isoformat()},
@@ -96,6 +176,10 @@ def users_summary():
         "mau": mau,
         "by_country": country_counts,
         "by_age_bracket": age_counts,
+        # by_country/by_age_bracket count a user once per active UTC day (see
+        # backend.crud.rollups); days scanned for lack of rollup rows can only
+        # see each user's latest update, so they count that day alone
+        "breakdown_unit": "user_days",
     }), 200
 
 # ---- Tasks: created/done counts & state mix in range ----
@@ -112,34 +196,46 @@ def tasks_summary():
 
     since, until = _date_range()
 
-    created = (
+    created_q = (
         db.collection("tasks")
         .where("createdAt", ">=", since)
         .where("createdAt", "<=", until)
-        .count().get()[0][0].value
     )
 
-    done = (
+    done_q = (
         db.collection("tasks")
         .where("state", "==", "Done")
         .where("updatedAt", ">=", since)
         .where("updatedAt", "<=", until)
-        .count().get()[0][0].value
     )
 
-    # state mix (client-side count)
-    state_mix: Dict[str,int] = {}
-    snaps = (
-        db.collection("tasks")
-        .where("updatedAt", ">=", since)
-        .where("updatedAt", "<=", until)
-        .stream()
+    rollup_q = (
+        db.collection(TASKS_ROLLUP)
+        .where("date", ">=", day_key(since))
+        .where("date", "<=", day_key(until))
     )
-    for s in snaps:
-        st = (s.to_dict().get("state") or "unknown")
-        state_mix[st] = state_mix.get(st, 0) + 1
 
-    db.collection("activity_logs").document().set({
+    f_created = _POOL.submit(_count, created_q)
+    f_done = _POOL.submit(_count, done_q)
+    f_rollup = _POOL.submit(lambda: list(rollup_q.stream()))
+    created = f_created.result()
+    done = f_done.result()
+    rollup = f_rollup.result()
+
+    # state mix (client-side count; rollup rows where they exist, as in users_summary)
+    state_mix: Counter[str] = Counter()
+    covered: Set[str] = set()
+    for r in rollup:
+        row = r.to_dict()
+        covered.add(row.get("date"))
+        n = int(row.get("count") or 0)
+        if n:
+            st = row.get("state") or "unknown"
+            state_mix[st] += n
+    for states in _POOL.map(lambda span: _scan_task_states(*span), _uncovered_spans(since, until, covered)):
+        state_mix.update(states)
+
+    audit_queue.enqueue({
         "userId": admin_uid,
         "action": "admin.analytics.tasks_summary",
         "params": {"since": since.isoformat(), "until": until.isoformat()},
@@ -151,6 +247,7 @@ def tasks_summary():
         "created": created,
         "done": done,
         "state_mix": state_mix,
+        "state_mix_unit": "task_days",  # once per active UTC day, as by_country above
     }), 200
 
 def register_admin_analytics_routes(app):
@@ -1,9 +1,14 @@
 # backend/api/archive.py
 from __future__ import annotations
-from typing import Any, Dict, List, Optional, Tuple
-from flask import Blueprint, request, jsonify, current_app, Response
-from firebase_admin import auth as fb_auth
-from backend.client import db, SERVER_TS  # type: ignore
+from datetime import datetime, timezone
+from itertools import chain
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+from firebase_admin import firestore  # type: ignore
+from backend import audit_queue
+from backend.auth import require_uid
+from backend.client import db, lazy, SERVER_TS  # type: ignore
+from backend.crud.utils import encode_page_token, decode_page_token, stream_json_array
 
 bp = Blueprint("archive", __name__)
 
@@ -23,6 +28,11 @@ TARGET_COLLECTIONS = {
 }
 ALLOWED_REF_TYPES = set(TARGET_COLLECTIONS.keys())
 
+# Collection references are immutable; build them once (on first use) instead of per request.
+_COL_REFS = lazy(lambda: {k: db.collection(v) for k, v in TARGET_COLLECTIONS.items()})  # type: ignore
+_ARCHIVE_COL = lazy(lambda: db.collection(COL_ARCHIVE))  # type: ignore
+_AUDIT_COL = lazy(lambda: db.collection(COL_AUDIT))  # type: ignore
+
 # -----------------------------------------------------------------------------
 # Utilities
 # -----------------------------------------------------------------------------
@@ -30,12 +40,7 @@ def _err(msg: str, code: int) -> Tuple[Response, int]:
     return jsonify({"error": msg}), code
 
 def _require_auth_uid() -> str:
-    authz = request.headers.get("Authorization", "")
-    if not authz.startswith("Bearer "):
-        raise ValueError("Missing or invalid Authorization header")
-    token = authz.split(" ", 1)[1]
-    decoded = fb_auth.verify_id_token(token)
-    return decoded["uid"]
+    return require_uid()
 
 def _serialize_doc(snap) -> Dict[str, Any]:
     data = snap.to_dict()
@@ -52,29 +57,38 @@ def _shallow_diff(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
       - unchanged: list[str]
     NOTE: shallow (one level); values shown raw (OK for our small docs).
     """
-    old_keys, new_keys = set(old.keys()), set(new.keys())
+    # keys() views support set algebra without copying the dicts
+    old_keys, new_keys = old.keys(), new.keys()
     added = sorted(new_keys - old_keys)
     removed = sorted(old_keys - new_keys)
     changed: Dict[str, Dict[str, Any]] = {}
     unchanged: List[str] = []
-    for k in sorted(old_keys & new_keys):
-        if old[k] != new[k]:
-            changed[k] = {"from": old[k], "to": new[k]}
-        else:
+    for k, nv in new.items():
+        if k not in old:
+            continue
+        ov = old[k]
+        if ov is nv or ov == nv:
             unchanged.append(k)
+        else:
+            changed[k] = {"from": ov, "to": nv}
+    unchanged.sort()
     return {"added": added, "removed": removed, "changed": changed, "unchanged": unchanged}
 
-def _write_audit(uid: str, action: str, details: Dict[str, Any]) -> None:
-    doc = {
+def _audit_doc(uid: str, action: str, details: Dict[str, Any]) -> Dict[str, Any]:
+    return {
         "userId": uid,
         "action": action,  # e.g., "archive.create", "archive.restore"
         "details": details,
         "timestamp": SERVER_TS,  # type: ignore
     }
-    db.collection(COL_AUDIT).document().set(doc)  # type: ignore
+
+def _write_audit(uid: str, action: str, details: Dict[str, Any]) -> None:
+    audit_queue.enqueue(_audit_doc(uid, action, details), COL_AUDIT)
 
 def _load_owned_archive(uid: str, archive_id: str) -> Optional[Dict[str, Any]]:
-    snap = db.collection(COL_ARCHIVE).document(archive_id).get()  # type: ignore
+    return _owned_archive_from_snap(uid, _ARCHIVE_COL.document(archive_id).get())  # type: ignore
+
+def _owned_archive_from_snap(uid: str, snap) -> Optional[Dict[str, Any]]:
     if not snap.exists:
         return None
     data = snap.to_dict()
@@ -83,6 +97,38 @@ def _load_owned_archive(uid: str, archive_id: str) -> Optional[Dict[str, Any]]:
     data["id"] = snap.id
     return data
 
+@firestore.transactional
+def _restore_in_transaction(transaction, uid: str, archive_id: str, target_col: str,
+                            ref, snapshot: Dict[str, Any], mode: str) -> Dict[str, Any]:
+    """
+    Read the target, diff it and write target + archive marker + audit in one
+    commit, so the diff always describes exactly what was overwritten.
+    """
+    current_snap = ref.get(transaction=transaction)
+    current = current_snap.to_dict() if current_snap.exists else {}
+    diff = _shallow_diff(current or {}, snapshot)
+
+    if mode == "replace":
+        transaction.set(ref, snapshot)
+    else:
+        transaction.set(ref, snapshot, merge=True)
+
+    # Mark archive as restored
+    transaction.set(_ARCHIVE_COL.document(archive_id), {  # type: ignore
+        "restoredAt": SERVER_TS,                # type: ignore
+        "restoreCount": firestore.Increment(1),
+    }, merge=True)
+
+    # Audit
+    transaction.set(_AUDIT_COL.document(), _audit_doc(uid, "archive.restore", {  # type: ignore
+        "archiveId": archive_id,
+        "targetCollection": target_col,
+        "targetId": ref.id,
+        "mode": mode,
+        "diff": diff,
+    }))
+    return diff
+
 # -----------------------------------------------------------------------------
 # Core operations (callable from routes)
 # -----------------------------------------------------------------------------
@@ -94,7 +140,7 @@ def add_archive(uid: str, ref_type: str, ref_id: str, snapshot: Dict[str, Any])
     # enforce ownership within snapshot
     snapshot["userId"] = uid
 
-    doc_ref = db.collection(COL_ARCHIVE).document()  # type: ignore
+    doc_ref = _ARCHIVE_COL.document()  # type: ignore
     to_write = {
         "userId": uid,
         "refType": ref_type,       # "task" | "chaos_entry" | ...
@@ -104,13 +150,14 @@ def add_archive(uid: str, ref_type: str, ref_id: str, snapshot: Dict[str, Any])
         "restoreCount": 0,
     }
     doc_ref.set(to_write)
-    snap = doc_ref.get()
-    result = {"id": snap.id, **snap.to_dict()}  # type: ignore
-    _write_audit(uid, "archive.create", {"archiveId": snap.id, "refType": ref_type, "refId": ref_id})
+    # Echo what we wrote instead of reading it back; createdAt is our clock,
+    # close enough to the stored server timestamp for display.
+    result = {"id": doc_ref.id, **to_write, "createdAt": datetime.now(timezone.utc)}
+    _write_audit(uid, "archive.create", {"archiveId": doc_ref.id, "refType": ref_type, "refId": ref_id})
     return result
 
 def delete_archived_entry(uid: str, archive_id: str) -> bool:
-    ref = db.collection(COL_ARCHIVE).document(archive_id)  # type: ignore
+    ref = _ARCHIVE_COL.document(archive_id)  # type: ignore
     snap = ref.get()
     if not snap.exists:
         return False
@@ -121,16 +168,32 @@ def delete_archived_entry(uid: str, archive_id: str) -> bool:
     _write_audit(uid, "archive.delete", {"archiveId": archive_id})
     return True
 
-def list_archived_for_user(uid: str, ref_type: Optional[str], limit: int, start_after: Optional[str]) -> List[Dict[str, Any]]:
-    q = db.collection(COL_ARCHIVE).where("userId", "==", uid).order_by("createdAt")  # type: ignore
+def iter_archived_for_user(uid: str, ref_type: Optional[str], limit: int, start_after: Optional[str]) -> Iterator[Dict[str, Any]]:
+    """
+    Lazily yields the user's archive entries, each with a `pageToken` to resume after it.
+    `start_after` is such a token (or, for older clients, a doc id).
+    """
+    q = _ARCHIVE_COL.where("userId", "==", uid).order_by("createdAt").order_by("__name__")  # type: ignore
     if ref_type:
         q = q.where("refType", "==", ref_type)
     if start_after:
-        last = db.collection(COL_ARCHIVE).document(start_after).get()  # type: ignore
-        if last.exists:
-            q = q.start_after(last)
+        cursor = decode_page_token(start_after)
+        if cursor:
+            created_at, doc_id = cursor
+            q = q.start_after({"createdAt": created_at, "__name__": doc_id})
+        else:
+            last = _ARCHIVE_COL.document(start_after).get()  # type: ignore
+            if last.exists:
+                q = q.start_after(last)
     q = q.limit(max(1, min(limit, 100)))
-    return [_serialize_doc(d) for d in q.stream()]  # type: ignore
+    for d in q.stream():  # type: ignore
+        entry = _serialize_doc(d)
+        if isinstance(entry.get("createdAt"), datetime):
+            entry["pageToken"] = encode_page_token(entry["createdAt"], entry["id"])
+        yield entry
+
+def list_archived_for_user(uid: str, ref_type: Optional[str], limit: int, start_after: Optional[str]) -> List[Dict[str, Any]]:
+    return list(iter_archived_for_user(uid, ref_type, limit, start_after))
 
 def restore_archived(uid: str, archive: Dict[str, Any], mode: str = "merge", new_id: Optional[str] = None) -> Dict[str, Any]:
     # target collection
@@ -145,34 +208,11 @@ def restore_archived(uid: str, archive: Dict[str, Any], mode: str = "merge", new
     snapshot["userId"] = uid  # keep ownership correct
 
     ref_id = archive.get("refId") or new_id
-    ref = db.collection(target_col).document(ref_id) if ref_id else db.collection(target_col).document()  # type: ignore
+    ref = _COL_REFS[ref_type].document(ref_id or None)  # None -> auto-ID
     target_id = ref.id
 
-    # Diff (compare current vs snapshot) BEFORE write
-    current_snap = ref.get()
-    current = current_snap.to_dict() if current_snap.exists else {}
-    diff = _shallow_diff(current or {}, snapshot)
-
-    # Write back
-    if mode == "replace":
-        ref.set(snapshot)
-    else:
-        ref.set(snapshot, merge=True)
-
-    # Mark archive as restored
-    db.collection(COL_ARCHIVE).document(archive["id"]).set({  # type: ignore
-        "restoredAt": SERVER_TS,            # type: ignore
-        "restoreCount": (archive.get("restoreCount") or 0) + 1
-    }, merge=True)
-
-    # Audit
-    _write_audit(uid, "archive.restore", {
-        "archiveId": archive["id"],
-        "targetCollection": target_col,
-        "targetId": target_id,
-        "mode": mode,
-        "diff": diff,
-    })
+    # Diff (compare current vs snapshot) and write back atomically
+    diff = _restore_in_transaction(db.transaction(), uid, archive["id"], target_col, ref, snapshot, mode)  # type: ignore
 
     return {
         "restored": True,
@@ -224,15 +264,18 @@ def list_archive_http():
         return _err("Unauthorized", 401)
 
     ref_type = request.args.get("ref_type")
-    limit = int(request.args.get("limit", 50))
+    limit = max(1, min(int(request.args.get("limit", 50)), 100))
     start_after = request.args.get("startAfter")
 
     try:
-        entries = list_archived_for_user(uid, ref_type, limit, start_after)
+        entries = iter_archived_for_user(uid, ref_type, limit, start_after)
+        first = next(entries, None)  # surface query errors as a 500 before streaming starts
     except Exception as e:
         current_app.logger.exception(e)
         return _err("Internal error", 500)
-    return jsonify(entries), 200
+
+    items = chain((first,), entries) if first is not None else ()
+    return Response(stream_with_context(stream_json_array(items)), 200, mimetype="application/json")
 
 @bp.get("/archive/<archive_id>")
 def get_archive_http(archive_id: str):
@@ -271,7 +314,9 @@ def restore_archive_http(archive_id: str):
       {
         "mode": "merge" | "replace",  // default: "merge"
         "newId": "string",            // optional if original refId is missing
-        "dryRun": true                // if true, don't write; just return diff/target info
+        "dryRun": true,               // if true, don't write; just return diff/target info
+        "refType": "task",            // optional hints (from the listing) that let a
+        "refId": "string"             //   dry run fetch archive + target in one RPC
       }
     """
     try:
@@ -279,18 +324,30 @@ def restore_archive_http(archive_id: str):
     except Exception:
         return _err("Unauthorized", 401)
 
-    owned = _load_owned_archive(uid, archive_id)
+    body = request.get_json(silent=True) or {}
+    dry_run = bool(body.get("dryRun", False))
+
+    # A dry run needs the target doc too. If the client told us which one it
+    # expects, read archive + target together; the hint is checked below.
+    prefetched = None
+    hint_type, hint_id = body.get("refType"), body.get("refId")
+    if dry_run and isinstance(hint_type, str) and hint_type in _COL_REFS and isinstance(hint_id, str) and hint_id:
+        archive_ref = _ARCHIVE_COL.document(archive_id)  # type: ignore
+        hint_ref = _COL_REFS[hint_type].document(hint_id)
+        snaps = {s.reference.path: s for s in db.get_all([archive_ref, hint_ref])}  # type: ignore
+        owned = _owned_archive_from_snap(uid, snaps[archive_ref.path])
+        prefetched = snaps[hint_ref.path]
+    else:
+        owned = _load_owned_archive(uid, archive_id)
     if owned is None:
         return _err("Archive entry not found", 404)
     if owned == "forbidden":
         return _err("Forbidden", 403)
 
-    body = request.get_json(silent=True) or {}
     mode = (body.get("mode") or "merge").lower()
     if mode not in ("merge", "replace"):
         return _err("mode must be 'merge' or 'replace'", 400)
     new_id = body.get("newId")
-    dry_run = bool(body.get("dryRun", False))
 
     # Compute target and diff regardless (for preview)
     ref_type = owned.get("refType")
@@ -304,14 +361,16 @@ def restore_archive_http(archive_id: str):
     snapshot["userId"] = uid
 
     ref_id = owned.get("refId") or new_id
-    doc_ref = db.collection(target_col).document(ref_id) if ref_id else db.collection(target_col).document()  # type: ignore
+    doc_ref = _COL_REFS[ref_type].document(ref_id or None)  # None -> auto-ID
     target_id = doc_ref.id
 
-    current_snap = doc_ref.get()
-    current = current_snap.to_dict() if current_snap.exists else {}
-    diff = _shallow_diff(current or {}, snapshot)
-
     if dry_run:
+        if prefetched is not None and prefetched.reference.path == doc_ref.path:
+            current_snap = prefetched
+        else:
+            current_snap = doc_ref.get()
+        current = current_snap.to_dict() if current_snap.exists else {}
+        diff = _shallow_diff(current or {}, snapshot)
         return jsonify({
             "restored": False,
             "dryRun": True,
@@ -324,23 +383,7 @@ def restore_archive_http(archive_id: str):
 
     # Execute restore
     try:
-        if mode == "replace":
-            doc_ref.set(snapshot)
-        else:
-            doc_ref.set(snapshot, merge=True)
-
-        db.collection(COL_ARCHIVE).document(archive_id).set({  # type: ignore
-            "restoredAt": SERVER_TS,            # type: ignore
-            "restoreCount": (owned.get("restoreCount") or 0) + 1
-        }, merge=True)
-
-        _write_audit(uid, "archive.restore", {
-            "archiveId": archive_id,
-            "targetCollection": target_col,
-            "targetId": target_id,
-            "mode": mode,
-            "diff": diff,
-        })
+        diff = _restore_in_transaction(db.transaction(), uid, archive_id, target_col, doc_ref, snapshot, mode)  # type: ignore
 
         return jsonify({
             "restored": True,
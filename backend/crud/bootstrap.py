@@ -1,9 +1,12 @@
 # backend/api/bootstrap.py
 from __future__ import annotations
-from typing import Any, Dict, Tuple
+from typing import Any, Dict, List, Tuple
 from flask import Blueprint, request, jsonify
-from firebase_admin import auth as fb_auth
+from firebase_admin import firestore  # type: ignore
+from backend.auth import require_uid
+from backend.batching import BatchOp, commit_batched
 from backend.client import db, SERVER_TS  # type: ignore
+from backend.crud.rollups import new_task_rollup_writes, user_rollup_writes
 
 bp = Blueprint("bootstrap", __name__)
 
@@ -11,12 +14,21 @@ def _err(msg: str, code: int) -> Tuple[Any, int]:
     return jsonify({"error": msg}), code
 
 def _uid_from_auth() -> str:
-    authz = request.headers.get("Authorization", "")
-    if not authz.startswith("Bearer "):
-        raise ValueError("Missing or invalid Authorization header")
-    token = authz.split(" ", 1)[1]
-    decoded = fb_auth.verify_id_token(token)
-    return decoded["uid"]
+    return require_uid()
+
+@firestore.transactional
+def _touch_user(transaction, ref, uid: str) -> None:
+    # read + write in one transaction so the rollup can't double count the user
+    snap = ref.get(transaction=transaction)
+    prev = snap.to_dict() if snap.exists else {}
+    write = {
+        "uid": uid,
+        "updatedAt": SERVER_TS,  # type: ignore
+        "lastSignIn": SERVER_TS  # type: ignore
+    }
+    transaction.set(ref, write, merge=True)
+    for rollup_ref, rollup in user_rollup_writes(prev, {**prev, **write}):
+        transaction.set(rollup_ref, rollup, merge=True)
 
 @bp.post("/bootstrap/import")
 def import_local_data():
@@ -35,15 +47,20 @@ def import_local_data():
     archived = body.get("archived_entries") or []
     chaos = body.get("chaos_entries") or []
 
-    # 3) Upsert user doc (optional hardening)
-    db.collection("users").document(uid).set({
-        "uid": uid,
-        "updatedAt": SERVER_TS,  # type: ignore
-        "lastSignIn": SERVER_TS  # type: ignore
-    }, merge=True)
+    # Writes are queued and committed in WriteBatches of up to 500 docs,
+    # so an import costs one round-trip per 500 docs instead of one per doc.
+    ops: List[BatchOp] = []
+
+    def _queue_set(ref, data: Dict[str, Any], **kwargs) -> None:
+        ops.append(lambda b: b.set(ref, data, **kwargs))
+
+    # 3) Upsert user doc (optional hardening); it bumps updatedAt, so it goes
+    #    through the users rollup like any other user write
+    _touch_user(db.transaction(), db.collection("users").document(uid), uid)  # type: ignore
 
     # 4) Create docs & build id mapping
     task_map: Dict[str, str] = {}
+    task_states: List[str] = []
     for t in tasks:
         local_id = t.get("localId")
         if not local_id:
@@ -59,8 +76,11 @@ def import_local_data():
             "updatedAt": SERVER_TS,  # type: ignore
         }
         ref = db.collection("tasks").document()  # type: ignore
-        ref.set(payload)
+        _queue_set(ref, payload)
         task_map[local_id] = ref.id
+        task_states.append(payload["state"])
+    for ref, rollup in new_task_rollup_writes(task_states):
+        _queue_set(ref, rollup, merge=True)
 
     arch_map: Dict[str, str] = {}
     for a in archived:
@@ -79,7 +99,7 @@ def import_local_data():
             "restoreCount": 0
         }
         ref = db.collection("archived_entries").document()  # type: ignore
-        ref.set(doc)
+        _queue_set(ref, doc)
         arch_map[local_id] = ref.id
 
     chaos_map: Dict[str, str] = {}
@@ -95,9 +115,11 @@ def import_local_data():
             "updatedAt": SERVER_TS,  # type: ignore
         }
         ref = db.collection("chaos_entries").document()  # type: ignore
-        ref.set(payload)
+        _queue_set(ref, payload)
         chaos_map[local_id] = ref.id
 
+    commit_batched(ops)
+
     return jsonify({
         "tasks": task_map,
         "archived_entries": arch_map,
@@ -1,24 +1,36 @@
 # backend/api/chaos_entries.py
+# list_chaos relies on composite indexes declared in firebase/firestore.indexes.json
+# (userId [+ pinned] [+ tags CONTAINS] + createdAt); deploy them with
+# `firebase deploy --only firestore:indexes`, otherwise filtered lists fail
+# with FAILED_PRECONDITION instead of being served from the index.
 from __future__ import annotations
-from typing import Any, Dict, List, Optional, Tuple
+from itertools import chain
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 from datetime import datetime, timezone
-from flask import Blueprint, request, jsonify, current_app, Response
-from firebase_admin import auth as fb_auth
-from backend.client import db, SERVER_TS  # type: ignore
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+from backend.auth import require_decoded_token
+from backend.client import db, lazy, SERVER_TS  # type: ignore
+from backend.crud.utils import encode_page_token, decode_page_token, stream_json_array, stream_query
+from backend.time_utils import parse_iso as _parse_iso
 
 bp = Blueprint("chaos", __name__)
 COL = "chaos_entries"
 
+# Collection references are immutable; build them once (on first use) instead of per call.
+_COL = lazy(lambda: db.collection(COL))  # type: ignore
+
+# Create/update bodies are small JSON objects; anything bigger is refused before parsing.
+MAX_BODY_BYTES = 64 * 1024
+
+# ?pinned= spellings; anything else means "no pinned filter"
+_PINNED_VALUES: Dict[str, bool] = {"1": True, "true": True, "yes": True, "0": False, "false": False, "no": False}
+
 # ----------------- helpers -----------------
 def _err(msg: str, code: int) -> Tuple[Response, int]:
     return jsonify({"error": msg}), code
 
 def _require_decoded_token() -> Dict[str, Any]:
-    authz = request.headers.get("Authorization", "")
-    if not authz.startswith("Bearer "):
-        raise ValueError("Missing or invalid Authorization header")
-    token = authz.split(" ", 1)[1]
-    return fb_auth.verify_id_token(token)
+    return require_decoded_token()
 
 def _require_auth_uid() -> str:
     return _require_decoded_token()["uid"]
@@ -28,21 +40,41 @@ def _serialize_doc(snap) -> Dict[str, Any]:
     d["id"] = snap.id
     return d
 
-def _parse_iso(s: Optional[str]) -> Optional[datetime]:
-    if not s:
-        return None
-    try:
-        # Accept 'YYYY-MM-DD' or ISO8601; coerce to UTC
-        if len(s) == 10 and s.count("-") == 2:
-            return datetime.fromisoformat(s).replace(tzinfo=timezone.utc)
-        return datetime.fromisoformat(s.replace("Z", "+00:00")).astimezone(timezone.utc)
-    except Exception:
-        return None
+def _echo_write(doc_id: str, data: Dict[str, Any], commit_time: datetime) -> Dict[str, Any]:
+    """
+    The doc as stored, without reading it back: SERVER_TS fields resolve to the
+    write's commit time, which the WriteResult already carries.
+    """
+    d = {k: (commit_time if v is SERVER_TS else v) for k, v in data.items()}
+    d["id"] = doc_id
+    return d
+
+def _merge(cur: Dict[str, Any], write: Dict[str, Any]) -> Dict[str, Any]:
+    # set(merge=True) semantics: non-empty nested maps merge key by key; everything
+    # else, including an empty map, replaces the stored value
+    out = dict(cur)
+    for k, v in write.items():
+        out[k] = _merge(out[k], v) if isinstance(v, dict) and v and isinstance(out.get(k), dict) else v
+    return out
+
+def _changes(cur: Dict[str, Any], k: str, v: Any) -> bool:
+    # a non-empty map merges into the stored one; anything else (incl. {}) replaces it
+    if k not in cur:
+        return True
+    if isinstance(v, dict) and v and isinstance(cur[k], dict):
+        return any(_changes(cur[k], kk, vv) for kk, vv in v.items())
+    return v != cur[k]
+
+def _with_page_token(d: Dict[str, Any]) -> Dict[str, Any]:
+    # pass the last item's pageToken back as ?startAfter= to resume after it
+    if isinstance(d.get("createdAt"), datetime):
+        d["pageToken"] = encode_page_token(d["createdAt"], d["id"])
+    return d
 
 def _coerce_int(v: Optional[str], default: int, lo: int = 1, hi: int = 200) -> int:
     try:
         n = int(v) if v is not None else default
-        return max(lo, min(hi, n))
+        return n if lo <= n <= hi else (lo if n < lo else hi)
     except Exception:
         return default
 
@@ -64,12 +96,12 @@ def create_chaos(uid: str, data: Dict[str, Any]) -> Dict[str, Any]:
         "createdAt": SERVER_TS,                        # type: ignore
         "updatedAt": SERVER_TS,                        # type: ignore
     }
-    ref = db.collection(COL).document()  # type: ignore
-    ref.set(payload)                      # type: ignore
-    return _serialize_doc(ref.get())
+    ref = _COL.document()  # type: ignore
+    result = ref.set(payload)             # type: ignore
+    return _echo_write(ref.id, payload, result.update_time)
 
 def get_chaos(uid: str, chaos_id: str) -> Optional[Dict[str, Any] | str]:
-    snap = db.collection(COL).document(chaos_id).get()  # type: ignore
+    snap = _COL.document(chaos_id).get()  # type: ignore
     if not snap.exists:
         return None
     data = snap.to_dict()
@@ -78,7 +110,7 @@ def get_chaos(uid: str, chaos_id: str) -> Optional[Dict[str, Any] | str]:
     return _serialize_doc(snap)
 
 def update_chaos(uid: str, chaos_id: str, updates: Dict[str, Any]) -> Optional[Dict[str, Any] | str]:
-    ref = db.collection(COL).document(chaos_id)  # type: ignore
+    ref = _COL.document(chaos_id)  # type: ignore
     snap = ref.get()
     if not snap.exists:
         return None
@@ -107,15 +139,17 @@ def update_chaos(uid: str, chaos_id: str, updates: Dict[str, Any]) -> Optional[D
         if parsed:
             write["capturedAt"] = parsed
 
+    # drop fields whose value wouldn't change (e.g. pinned toggled back); all no-op -> no write
+    write = {k: v for k, v in write.items() if _changes(cur, k, v)}
     if not write:
         return _serialize_doc(snap)
 
     write["updatedAt"] = SERVER_TS  # type: ignore
-    ref.set(write, merge=True)
-    return _serialize_doc(ref.get())
+    result = ref.set(write, merge=True)
+    return _echo_write(chaos_id, _merge(cur, write), result.update_time)
 
 def delete_chaos(uid: str, chaos_id: str) -> Optional[str | str]:
-    ref = db.collection(COL).document(chaos_id)  # type: ignore
+    ref = _COL.document(chaos_id)  # type: ignore
     snap = ref.get()
     if not snap.exists:
         return None
@@ -124,7 +158,7 @@ def delete_chaos(uid: str, chaos_id: str) -> Optional[str | str]:
     ref.delete()
     return chaos_id
 
-def list_chaos(
+def iter_chaos(
     uid: str,
     start: Optional[datetime],
     end: Optional[datetime],
@@ -132,8 +166,8 @@ def list_chaos(
     start_after_id: Optional[str],
     pinned: Optional[bool],
     has_tag: Optional[str],
-) -> List[Dict[str, Any]]:
-    q = db.collection(COL).where("userId", "==", uid)  # type: ignore
+) -> Iterator[Dict[str, Any]]:
+    q = _COL.where("userId", "==", uid)  # type: ignore
 
     if pinned is not None:
         q = q.where("pinned", "==", pinned)
@@ -142,8 +176,8 @@ def list_chaos(
         # Firestore supports array membership via array_contains
         q = q.where("tags", "array_contains", has_tag)
 
-    # Use createdAt for stable sort/pagination
-    q = q.order_by("createdAt")
+    # Use createdAt (then doc id as tiebreak) for stable sort/pagination
+    q = q.order_by("createdAt").order_by("__name__")
 
     if start:
         q = q.where("createdAt", ">=", start)
@@ -151,12 +185,28 @@ def list_chaos(
         q = q.where("createdAt", "<=", end)
 
     if start_after_id:
-        last = db.collection(COL).document(start_after_id).get()  # type: ignore
-        if last.exists:
-            q = q.start_after(last)
+        cursor = decode_page_token(start_after_id)
+        if cursor:
+            created_at, doc_id = cursor
+            q = q.start_after({"createdAt": created_at, "__name__": doc_id})
+        else:  # plain doc id from older clients
+            last = _COL.document(start_after_id).get()  # type: ignore
+            if last.exists:
+                q = q.start_after(last)
 
     q = q.limit(limit)
-    return [_serialize_doc(d) for d in q.stream()]  # type: ignore
+    return (_with_page_token(_serialize_doc(d)) for d in stream_query(q, "chaos_entries.list"))
+
+def list_chaos(
+    uid: str,
+    start: Optional[datetime],
+    end: Optional[datetime],
+    limit: int,
+    start_after_id: Optional[str],
+    pinned: Optional[bool],
+    has_tag: Optional[str],
+) -> List[Dict[str, Any]]:
+    return list(iter_chaos(uid, start, end, limit, start_after_id, pinned, has_tag))
 
 # ----------------- routes -----------------
 @bp.post("/chaos")
@@ -167,7 +217,9 @@ def create_chaos_http():
         return _err("Unauthorized", 401)
     if not request.is_json:
         return _err("Content-Type must be application/json", 415)
-    body = request.get_json(silent=True) or {}
+    if (request.content_length or 0) > MAX_BODY_BYTES:
+        return _err("Payload too large", 413)
+    body = request.get_json(silent=True, cache=False) or {}
     try:
         doc = create_chaos(uid, body)
         return jsonify(doc), 201
@@ -198,7 +250,9 @@ def update_chaos_http(chaos_id: str):
         return _err("Unauthorized", 401)
     if not request.is_json:
         return _err("Content-Type must be application/json", 415)
-    body = request.get_json(silent=True) or {}
+    if (request.content_length or 0) > MAX_BODY_BYTES:
+        return _err("Payload too large", 413)
+    body = request.get_json(silent=True, cache=False) or {}
     try:
         result = update_chaos(uid, chaos_id, body)
     except ValueError as ve:
@@ -242,14 +296,16 @@ def list_chaos_http():
 
     pinned_bool: Optional[bool] = None
     if pinned is not None:
-        if pinned.lower() in ("1", "true", "yes"):
-            pinned_bool = True
-        elif pinned.lower() in ("0", "false", "no"):
-            pinned_bool = False
+        # exact hit for the usual lowercase values; lower() only for odd casing
+        pinned_bool = _PINNED_VALUES.get(pinned)
+        if pinned_bool is None:
+            pinned_bool = _PINNED_VALUES.get(pinned.lower())
 
     try:
-        items = list_chaos(uid, start, end, limit, start_after, pinned_bool, has_tag)
-        return jsonify(items), 200
+        items = iter_chaos(uid, start, end, limit, start_after, pinned_bool, has_tag)
+        first = next(items, None)  # surface query errors as a 500 before streaming starts
     except Exception as e:
         current_app.logger.exception(e)
         return _err("Internal error", 500)
+    body = chain((first,), items) if first is not None else ()
+    return Response(stream_with_context(stream_json_array(body)), 200, mimetype="application/json")
@@ -1,17 +1,30 @@
 # backend/api/dopamine_logs.py
 from __future__ import annotations
-from typing import Any, Dict, List, Optional, Tuple
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 from datetime import datetime, timedelta, timezone
-from flask import Blueprint, request, jsonify, current_app, Response
-from firebase_admin import auth as fb_auth
-from backend.client import db, SERVER_TS  # type: ignore
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+from firebase_admin import firestore  # type: ignore
+from backend import audit_queue
+from backend.auth import require_decoded_token
+from backend.batching import BatchOp, commit_batched
+from backend.client import db, lazy, SERVER_TS  # type: ignore
+from backend.crud.utils import encode_page_token, decode_page_token, stream_json_array, stream_query
+from backend.time_utils import parse_iso as _parse_iso
+from backend.crud.rollups import day_key, dopamine_totals_ref, dopamine_total_write
 
 bp = Blueprint("dopamine_logs", __name__)
 COL = "dopamine_logs"
 USERS = "users"
 AUDIT_COL = "activity_logs"
 
-ALLOWED_SOURCES = {
+# Collection references are immutable; build them once (on first use) instead of per call.
+_COL = lazy(lambda: db.collection(COL))  # type: ignore
+_USERS = lazy(lambda: db.collection(USERS))  # type: ignore
+
+ALLOWED_SOURCES = frozenset({
     "task_completed",
     "chaos_entry_created",
     "daily_session_review",
@@ -21,18 +34,28 @@ ALLOWED_SOURCES = {
     "plant_init",
     "plant_reset",
     "plant_deleted",
-}
+})
+_SOURCE_ERROR = f"source must be one of {sorted(ALLOWED_SOURCES)}"  # built once, not per bad request
+
+# Consent-join lookups above _CONSENT_CHUNK users fan out over this pool.
+_CONSENT_CHUNK = 100
+_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="dopamine-logs")
+
+# Create bodies are small JSON objects; anything bigger is refused before parsing.
+MAX_BODY_BYTES = 64 * 1024
+
+_WINDOWS = frozenset({"day", "week", "month"})
+
+# Summary aggregations (one per source) get their own pool, sized for two
+# summaries at a time, so they never queue ahead of the consent lookups above.
+_AGG_POOL = ThreadPoolExecutor(max_workers=2 * len(ALLOWED_SOURCES), thread_name_prefix="dopamine-agg")
 
 # ---------- helpers ----------
 def _err(msg: str, code: int) -> Tuple[Response, int]:
     return jsonify({"error": msg}), code
 
 def _require_decoded_token() -> Dict[str, Any]:
-    authz = request.headers.get("Authorization", "")
-    if not authz.startswith("Bearer "):
-        raise ValueError("Missing or invalid Authorization header")
-    token = authz.split(" ", 1)[1]
-    return fb_auth.verify_id_token(token)
+    return require_decoded_token()
 
 def _require_auth_uid() -> str:
     return _require_decoded_token()["uid"]
@@ -48,44 +71,94 @@ def _serialize_doc(snap) -> Dict[str, Any]:
     d["id"] = snap.id
     return d
 
-def _parse_iso(s: Optional[str]) -> Optional[datetime]:
-    if not s:
-        return None
-    try:
-        # Accept YYYY-MM-DD or ISO 8601
-        if len(s) == 10 and s.count("-") == 2:
-            return datetime.fromisoformat(s).replace(tzinfo=timezone.utc)
-        return datetime.fromisoformat(s.replace("Z", "+00:00")).astimezone(timezone.utc)
-    except Exception:
-        return None
-
 def _start_of_day(dt: datetime) -> datetime:
     dt = dt.astimezone(timezone.utc)
     return dt.replace(hour=0, minute=0, second=0, microsecond=0)
 
+def _with_page_token(d: Dict[str, Any]) -> Dict[str, Any]:
+    # pass the last item's pageToken back as ?startAfter= to resume after it
+    if isinstance(d.get("createdAt"), datetime):
+        d["pageToken"] = encode_page_token(d["createdAt"], d["id"])
+    return d
+
 def _coerce_int(v: Optional[str], default: int, lo: int = 1, hi: int = 200) -> int:
     try:
         n = int(v) if v is not None else default
-        return max(lo, min(hi, n))
+        return n if lo <= n <= hi else (lo if n < lo else hi)
     except Exception:
         return default
 
+def _consented_in(refs: List[Any]) -> Set[str]:
+    return {
+        s.id for s in db.get_all(refs, field_paths=["marketingConsent"])  # type: ignore
+        if s.exists and (s.to_dict() or {}).get("marketingConsent") is True
+    }
+
+def _consented_uids(uids: Iterable[Optional[str]]) -> Set[str]:
+    """
+    Subset of `uids` with marketingConsent == True. One get_all round-trip for
+    typical pages; large joins split into chunks fetched concurrently.
+    """
+    refs = [_USERS.document(u) for u in set(uids) if u]  # type: ignore
+    if len(refs) <= _CONSENT_CHUNK:
+        return _consented_in(refs) if refs else set()
+    chunks = [refs[i:i + _CONSENT_CHUNK] for i in range(0, len(refs), _CONSENT_CHUNK)]
+    return set().union(*_POOL.map(_consented_in, chunks))
+
+def _consented_rows(q, user_id: Optional[str], convert: Callable[[Any], Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Run admin query `q` and return only rows from consented users, overlapping
+    the consent reads with the query instead of running them after it:
+      - userId filter: the single consent check runs alongside the stream;
+      - otherwise: each full chunk of new userIds is looked up on the pool
+        while the stream keeps going.
+    """
+    if user_id:
+        f_ok = _POOL.submit(_consented_uids, [user_id])
+        rows = [convert(d) for d in q.stream()]
+        return rows if f_ok.result() else []
+
+    rows: List[Dict[str, Any]] = []
+    seen: Set[str] = set()
+    pending: List[str] = []
+    futures = []
+    for d in q.stream():
+        row = convert(d)
+        rows.append(row)
+        u = row.get("userId")
+        if u and u not in seen:
+            seen.add(u)
+            pending.append(u)
+            if len(pending) == _CONSENT_CHUNK:
+                futures.append(_POOL.submit(_consented_uids, pending))
+                pending = []
+    consented = _consented_uids(pending)
+    for f in futures:
+        consented |= f.result()
+    return [r for r in rows if r.get("userId") in consented]
+
 def _audit(uid: str, action: str, details: Dict[str, Any]) -> None:
-    db.collection(AUDIT_COL).document().set({  # type: ignore
+    # batched off the request path by audit_queue's worker thread
+    audit_queue.enqueue({
         "userId": uid,
         "action": action,
         "details": details,
         "timestamp": SERVER_TS,  # type: ignore
-    })
+    }, AUDIT_COL)
 
 # ---------- core ops ----------
-def create_log(uid: str, data: Dict[str, Any]) -> Dict[str, Any]:
+def create_log_ops(uid: str, data: Dict[str, Any]) -> Tuple[Any, Dict[str, Any], List[BatchOp]]:
+    """
+    Validate `data` and build the writes for one log (log doc + daily totals)
+    without committing them, so a caller can add them to its own batch or
+    transaction. Returns (log ref, log payload, ops).
+    """
     points = data.get("points")
     if not isinstance(points, int):
         raise ValueError("points must be an integer")
     source = data.get("source", "manual_reward")
     if source not in ALLOWED_SOURCES:
-        raise ValueError(f"source must be one of {sorted(ALLOWED_SOURCES)}")
+        raise ValueError(_SOURCE_ERROR)
 
     payload: Dict[str, Any] = {
         "userId": uid,
@@ -95,12 +168,22 @@ def create_log(uid: str, data: Dict[str, Any]) -> Dict[str, Any]:
         "note": data.get("note"),
         "createdAt": SERVER_TS,                 # type: ignore
     }
-    ref = db.collection(COL).document()   # type: ignore
-    ref.set(payload)                      # type: ignore
-    return _serialize_doc(ref.get())
+    ref = _COL.document()   # type: ignore
+    # per-user daily totals, so summaries read one doc per day instead of every log
+    total_ref, total = dopamine_total_write(uid, day_key(), source, points)
+    return ref, payload, [
+        lambda b: b.set(ref, payload),
+        lambda b: b.set(total_ref, total, merge=True),
+    ]
+
+def create_log(uid: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    ref, payload, ops = create_log_ops(uid, data)
+    result = commit_batched(ops)[0]
+    # echo instead of reading back; createdAt (SERVER_TS) resolves to the commit time
+    return {**payload, "createdAt": result.update_time, "id": ref.id}
 
 def get_log(uid: str, log_id: str) -> Optional[Dict[str, Any] | str]:
-    snap = db.collection(COL).document(log_id).get()  # type: ignore
+    snap = _COL.document(log_id).get()  # type: ignore
     if not snap.exists:
         return None
     data = snap.to_dict()
@@ -108,30 +191,48 @@ def get_log(uid: str, log_id: str) -> Optional[Dict[str, Any] | str]:
         return "forbidden"
     return _serialize_doc(snap)
 
-def delete_log(uid: str, log_id: str) -> Optional[str | str]:
-    ref = db.collection(COL).document(log_id)  # type: ignore
-    snap = ref.get()
+@firestore.transactional
+def _delete_log_in_transaction(transaction, uid: str, ref) -> Optional[str]:
+    snap = ref.get(transaction=transaction)
     if not snap.exists:
         return None
-    if snap.to_dict().get("userId") != uid:
+    data = snap.to_dict()
+    if data.get("userId") != uid:
         return "forbidden"
-    ref.delete()
-    return log_id
+    created = data.get("createdAt")
+    if isinstance(created, datetime):
+        day = day_key(created)
+        total_ref, total = dopamine_total_write(uid, day, data.get("source") or "unknown",
+                                                int(data.get("points", 0)), delta=-1)
+        # a log from before totals existed isn't in any totals doc; decrementing
+        # would create one with a negative count that summaries then trust
+        if TOTALS_SINCE is not None:
+            counted = day >= TOTALS_SINCE
+        else:
+            counted = total_ref.get(transaction=transaction).exists
+        if counted:
+            transaction.set(total_ref, total, merge=True)
+    transaction.delete(ref)
+    return ref.id
 
-def list_logs(
+def delete_log(uid: str, log_id: str) -> Optional[str | str]:
+    ref = _COL.document(log_id)  # type: ignore
+    return _delete_log_in_transaction(db.transaction(), uid, ref)  # type: ignore
+
+def iter_logs(
     uid: str,
     start: Optional[datetime],
     end: Optional[datetime],
     limit: int,
     start_after_id: Optional[str],
     source: Optional[str],
-) -> List[Dict[str, Any]]:
-    q = db.collection(COL).where("userId", "==", uid)  # type: ignore
+) -> Iterator[Dict[str, Any]]:
+    q = _COL.where("userId", "==", uid)  # type: ignore
     if source:
         q = q.where("source", "==", source)
 
-    # All logs are ordered by createdAt for range queries
-    q = q.order_by("createdAt")
+    # All logs are ordered by createdAt (then doc id as tiebreak) for range queries
+    q = q.order_by("createdAt").order_by("__name__")
 
     if start:
         q = q.where("createdAt", ">=", start)
@@ -139,22 +240,97 @@ def list_logs(
         q = q.where("createdAt", "<=", end)
 
     if start_after_id:
-        last = db.collection(COL).document(start_after_id).get()  # type: ignore
-        if last.exists:
-            q = q.start_after(last)
+        cursor = decode_page_token(start_after_id)
+        if cursor:
+            created_at, doc_id = cursor
+            q = q.start_after({"createdAt": created_at, "__name__": doc_id})
+        else:  # plain doc id from older clients
+            last = _COL.document(start_after_id).get()  # type: ignore
+            if last.exists:
+                q = q.start_after(last)
 
     q = q.limit(limit)
-    return [_serialize_doc(d) for d in q.stream()]  # type: ignore
+    return (_with_page_token(_serialize_doc(d)) for d in stream_query(q, "dopamine_logs.list"))
 
-def summarize(uid: str, start: datetime, end: datetime) -> Dict[str, Any]:
-    # Sum client-side from queried docs (fast enough for small windows).
-    items = list_logs(uid, start, end, limit=200, start_after_id=None, source=None)
-    total = sum(int(i.get("points", 0)) for i in items)
+def list_logs(
+    uid: str,
+    start: Optional[datetime],
+    end: Optional[datetime],
+    limit: int,
+    start_after_id: Optional[str],
+    source: Optional[str],
+) -> List[Dict[str, Any]]:
+    return list(iter_logs(uid, start, end, limit, start_after_id, source))
+
+_MAX_TOTALS_DAYS = 366
+# First UTC day (YYYY-MM-DD) from which every log has a totals doc, i.e. when
+# totals started being written: from then on a day without a doc had no logs,
+# and only the days before it are aggregated. Unset, totals are used only when
+# every day in the window has a doc.
+TOTALS_SINCE = os.getenv("DOPAMINE_TOTALS_SINCE") or None
+
+def _sum_totals(rows: List[Dict[str, Any]], extra: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    total = count = 0
     by_source: Dict[str, int] = {}
-    for i in items:
-        s = i.get("source") or "unknown"
-        by_source[s] = by_source.get(s, 0) + int(i.get("points", 0))
-    return {"total": total, "count": len(items), "bySource": by_source}
+    for r in ([extra] if extra else []) + rows:
+        total += int(r.get("total", 0))
+        count += int(r.get("count", 0))
+        for src, pts in (r.get("bySource") or {}).items():
+            by_source[src] = by_source.get(src, 0) + int(pts)
+    return {"total": total, "count": count, "bySource": {k: v for k, v in by_source.items() if v}}
+
+def _summarize_from_totals(uid: str, start: datetime, end: datetime) -> Optional[Dict[str, Any]]:
+    """
+    Sum the daily totals docs, or None (scan instead) if the window isn't whole
+    UTC days or some of its days may have logs without a totals doc.
+    """
+    first, last = _start_of_day(start), _start_of_day(end)
+    n_days = (last - first).days + 1
+    if start != first or end != last + timedelta(days=1, seconds=-1) or not 0 < n_days <= _MAX_TOTALS_DAYS:
+        return None
+    days = [day_key(first + timedelta(days=i)) for i in range(n_days)]
+    if TOTALS_SINCE is None:
+        covered = days
+    else:
+        covered = [d for d in days if d >= TOTALS_SINCE]
+        if not covered:
+            return None
+    snaps = db.get_all([dopamine_totals_ref(uid, d) for d in covered])  # type: ignore
+    rows = [s.to_dict() or {} for s in snaps if s.exists]
+    if TOTALS_SINCE is None:
+        # logs written before totals existed leave days without a doc; a
+        # partial sum would look complete, so only trust a full set
+        return _sum_totals(rows) if len(rows) == n_days else None
+    if len(covered) == n_days:
+        return _sum_totals(rows)
+    # days before TOTALS_SINCE predate the totals docs; aggregate just those
+    cutoff = datetime.fromisoformat(covered[0]).replace(tzinfo=timezone.utc)
+    before = _summarize_by_aggregation(uid, start, cutoff - timedelta(microseconds=1))
+    return _sum_totals(rows, before)
+
+def summarize(uid: str, start: datetime, end: datetime) -> Dict[str, Any]:
+    totals = _summarize_from_totals(uid, start, end)
+    if totals is not None:
+        return totals
+    return _summarize_by_aggregation(uid, start, end)
+
+def _aggregate(q) -> Tuple[int, int]:
+    """(total points, count) for `q`, computed server-side."""
+    row = {r.alias: r.value for r in q.count(alias="count").sum("points", alias="total").get()[0]}
+    return int(row.get("total") or 0), int(row.get("count") or 0)
+
+def _summarize_by_aggregation(uid: str, start: datetime, end: datetime) -> Dict[str, Any]:
+    # SUM/COUNT run in Firestore; only the aggregate rows come back. bySource
+    # needs one aggregation per source, issued concurrently.
+    q = _COL.where("userId", "==", uid)  # type: ignore
+    if start:
+        q = q.where("createdAt", ">=", start)
+    if end:
+        q = q.where("createdAt", "<=", end)
+    f_by = {src: _AGG_POOL.submit(_aggregate, q.where("source", "==", src)) for src in ALLOWED_SOURCES}
+    total, count = _aggregate(q)  # overall totals on this thread while the per-source ones run
+    by_source = {src: f.result()[0] for src, f in f_by.items()}
+    return {"total": total, "count": count, "bySource": {k: v for k, v in by_source.items() if v}}
 
 # ---------- user routes ----------
 @bp.post("/dopamine-logs")
@@ -165,10 +341,11 @@ def create_log_http():
         return _err("Unauthorized", 401)
     if not request.is_json:
         return _err("Content-Type must be application/json", 415)
-    body = request.get_json(silent=True) or {}
+    if (request.content_length or 0) > MAX_BODY_BYTES:
+        return _err("Payload too large", 413)
+    body = request.get_json(silent=True, cache=False) or {}
     try:
         doc = create_log(uid, body)
-        # optional: also write to daily total doc here if you later maintain denormalized tallies
         return jsonify(doc), 201
     except ValueError as ve:
         return _err(str(ve), 400)
@@ -217,11 +394,13 @@ def list_logs_http():
     end = _parse_iso(request.args.get("end"))
 
     try:
-        items = list_logs(uid, start, end, limit, start_after, source)
-        return jsonify(items), 200
+        items = iter_logs(uid, start, end, limit, start_after, source)
+        first = next(items, None)  # surface query errors as a 500 before streaming starts
     except Exception as e:
         current_app.logger.exception(e)
         return _err("Internal error", 500)
+    body = chain((first,), items) if first is not None else ()
+    return Response(stream_with_context(stream_json_array(body)), 200, mimetype="application/json")
 
 @bp.get("/dopamine-logs/summary")
 def summary_http():
@@ -236,7 +415,9 @@ def summary_http():
     except Exception:
         return _err("Unauthorized", 401)
 
-    window = (request.args.get("window") or "day").lower()
+    window = request.args.get("window") or "day"
+    if window not in _WINDOWS:
+        window = window.lower()
     date = _parse_iso(request.args.get("date"))
     start = _parse_iso(request.args.get("start"))
     end = _parse_iso(request.args.get("end"))
@@ -295,15 +476,8 @@ def admin_list_logs():
     end = _parse_iso(request.args.get("end"))
     user_id = request.args.get("userId")
 
-    # consent filter via join on users (read each doc; ok for admin tooling scale)
-    def _consented(u: str) -> bool:
-        snap = db.collection(USERS).document(u).get()  # type: ignore
-        return bool(snap.exists and (snap.to_dict() or {}).get("marketingConsent") is True)
-
-    q = db.collection(COL)  # type: ignore
+    q = _COL  # type: ignore
     if user_id:
-        if not _consented(user_id):
-            return jsonify([]), 200
         q = q.where("userId", "==", user_id)
     # range + order
     q = q.order_by("createdAt")
@@ -312,21 +486,13 @@ def admin_list_logs():
     if end:
         q = q.where("createdAt", "<=", end)
     if start_after:
-        last = db.collection(COL).document(start_after).get()  # type: ignore
+        last = _COL.document(start_after).get()  # type: ignore
         if last.exists:
             q = q.start_after(last)
     q = q.limit(limit)
 
-    docs = list(q.stream())  # type: ignore
-    items: List[Dict[str, Any]] = []
-    for d in docs:
-        row = _serialize_doc(d)
-        if user_id:
-            items.append(row)
-        else:
-            # per-row consent check (skip non-consented)
-            if _consented(row.get("userId")):
-                items.append(row)
+    # consent join on users, overlapped with the query
+    items = _consented_rows(q, user_id, _serialize_doc)
 
     _audit(admin_uid, "admin.dopamine.list", {
         "count": len(items),
@@ -356,32 +522,19 @@ def admin_summary():
     end = _parse_iso(request.args.get("end"))
     user_id = request.args.get("userId")
 
-    # fetch via admin_list_logs logic but without pagination (bounded windows suggested)
-    limit = 500
-    # Reuse list endpoint behavior quickly
-    with current_app.test_request_context():
-        pass
-
     # Build query
-    q = db.collection(COL).order_by("createdAt")  # type: ignore
+    q = _COL.order_by("createdAt")  # type: ignore
     if start: q = q.where("createdAt", ">=", start)
     if end:   q = q.where("createdAt", "<=", end)
     if user_id: q = q.where("userId", "==", user_id)
-    docs = list(q.limit(1000).stream())  # type: ignore
-
-    # Filter consent
-    def _consented(u: str) -> bool:
-        snap = db.collection(USERS).document(u).get()  # type: ignore
-        return bool(snap.exists and (snap.to_dict() or {}).get("marketingConsent") is True)
+    # Filter consent (looked up while the query streams)
+    rows = _consented_rows(q.limit(1000), user_id, lambda d: d.to_dict())
 
     total = 0
     count = 0
     by_user: Dict[str, int] = {}
-    for d in docs:
-        row = d.to_dict()
+    for row in rows:
         u = row.get("userId")
-        if not u or not _consented(u):
-            continue
         p = int(row.get("points", 0))
         total += p
         count += 1
@@ -2,21 +2,21 @@
 # Flask Blueprint for Dopamine Plant CRUD (Firestore + Marshmallow)
 # Aligns with Loopy's conventions: UID doc IDs, immutable logs, archive-before-delete
 
+from cachetools import TTLCache
+from google.api_core.exceptions import AlreadyExists, NotFound
+from google.cloud.firestore_v1 import Increment  # type: ignore
+from firebase_admin import firestore  # type: ignore
 from flask import Blueprint, request, jsonify
 from marshmallow import Schema, fields, validate, ValidationError
-from backend.crud.dopamSine_logs import create_log as create_dopa_log
-from backend.client import SERVER_TS  # to align timestamps if you want
+from backend.crud.dopamine_logs import create_log_ops as dopa_log_ops
+from backend import audit_queue
+from backend.auth import require_uid
+from backend.batching import commit_batched
+from backend.client import db, SERVER_TS  # type: ignore
 from datetime import datetime, timezone
-from firebase_admin import auth as fb_auth
 import random
 import os
-
-try:
-    # If your app initializes Firebase Admin centrally, just import the client here.
-    from firebase_admin import firestore  # type: ignore
-    db = firestore.client()
-except Exception as e:
-    db = None  # Allow import without initialized Firebase; app should set db later.
+import threading
 
 dopamine_bp = Blueprint("dopamine", __name__, url_prefix="/dopamine")
 
@@ -44,15 +44,18 @@ MANIFEST = {
     },
 }
 
+# (phase, variant) -> filename, flattened once so a lookup is a single dict hit
+MANIFEST_FLAT = {(int(p), v): fn for p, vs in MANIFEST.items() for v, fn in vs.items()}
+
 # Branching table (Phase/Variant → next choices)
 PHASE_BRANCHES = {
-    "1": ["2A", "2B"],        # 1→2
-    "2A": ["3A", "3B"],       # 2→3
-    "2B": ["3C", "3D"],       # 2→3
-    "3A": ["4A", "4B"],       # 3→4 (final)
-    "3B": ["4C", "4D"],
-    "3C": ["4E", "4F"],
-    "3D": ["4G", "4H"],
+    "1": ("2A", "2B"),        # 1→2
+    "2A": ("3A", "3B"),       # 2→3
+    "2B": ("3C", "3D"),       # 2→3
+    "3A": ("4A", "4B"),       # 3→4 (final)
+    "3B": ("4C", "4D"),
+    "3C": ("4E", "4F"),
+    "3D": ("4G", "4H"),
 }
 
 # Thresholds to advance per phase (tune via UX)
@@ -63,24 +66,54 @@ COL_PLANTS = "dopamine_plants"   # one active plant doc per user
 COL_LOGS   = "dopamine_logs"     # immutable logs (task + phase advance)
 COL_ARCH   = "archived_entries"  # shared archive
 
+# Short-lived per-process cache of plant state for /state polling. Write routes
+# in this process refresh it; writes served by another worker show up within
+# _STATE_TTL_SECONDS.
+_STATE_TTL_SECONDS = 5
+_state_cache: TTLCache = TTLCache(maxsize=10_000, ttl=_STATE_TTL_SECONDS)
+_state_lock = threading.Lock()  # guards _state_cache and _recent_tasks
+
+# Duplicate /task-complete submissions (same user + task_id within
+# _RECENT_TTL_SECONDS) get the first result back instead of counting twice.
+# Only the claim is taken under _state_lock; the Firestore work runs unlocked
+# (the transaction orders concurrent completions across workers).
+_RECENT_TTL_SECONDS = 10
+_recent_tasks: TTLCache = TTLCache(maxsize=50_000, ttl=_RECENT_TTL_SECONDS)
+_PENDING = object()  # _recent_tasks value while the first submission is still running
+
+# Fields /state returns (everything init_payload writes)
+_STATE_FIELDS = ["user_id", "phase", "variant", "tasks_completed_since_phase", "asset_filename", "last_updated"]
+
+# /task-complete reads only what it decides on, and rewrites only what it changes
+_TX_READ_FIELDS = ["phase", "variant", "tasks_completed_since_phase"]
+_TX_WRITE_FIELDS = ("phase", "variant", "tasks_completed_since_phase", "asset_filename", "last_updated")
+
 
 # --------------------------- Schemas ---------------------------
 
+# user_id is optional: the plant owner is the verified bearer token's uid, and
+# a user_id that is sent must match it.
 class InitSchema(Schema):
-    user_id = fields.String(required=True, validate=validate.Length(min=1))
+    user_id = fields.String(required=False, validate=validate.Length(min=1))
 
 class StateQuerySchema(Schema):
-    user_id = fields.String(required=True, validate=validate.Length(min=1))
+    user_id = fields.String(required=False, validate=validate.Length(min=1))
 
 class TaskCompleteSchema(Schema):
-    user_id = fields.String(required=True)
+    user_id = fields.String(required=False)
     task_id = fields.String(required=False, allow_none=True)
-    points  = fields.Integer(required=False, missing=1, validate=validate.Range(min=0))
+    points  = fields.Integer(required=False, load_default=1, validate=validate.Range(min=0))
 
 class ResetSchema(Schema):
-    user_id = fields.String(required=True)
+    user_id = fields.String(required=False)
     reason  = fields.String(required=False, allow_none=True)
 
+# Schemas are stateless for load(); build each once instead of per request.
+_INIT_SCHEMA = InitSchema()
+_STATE_SCHEMA = StateQuerySchema()
+_TASK_SCHEMA = TaskCompleteSchema()
+_RESET_SCHEMA = ResetSchema()
+
 
 # ------------------------ Helpers -----------------------------
 
@@ -88,26 +121,39 @@ def now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 def manifest_lookup(phase: int, variant: str) -> str:
-    return MANIFEST.get(str(phase), {}).get(variant, "")
+    return MANIFEST_FLAT.get((phase, variant), "")
+
+_INIT_ASSET = manifest_lookup(1, "POT")
 
 def plant_doc_ref(user_id: str):
     return db.collection(COL_PLANTS).document(user_id)
 
-def log_entry(payload: dict):
-    db.collection(COL_LOGS).add(payload)
-
-def archive_plant(user_id: str, plant_snapshot, cause: str = "manual"):
+def log_entry(payload: dict, batch=None):
+    """
+    Write an immutable log doc. With `batch` (a WriteBatch or Transaction) it
+    commits with that batch; otherwise it is handed to audit_queue and written
+    off the request path.
+    """
+    if batch is not None:
+        batch.set(db.collection(COL_LOGS).document(), payload)
+    else:
+        audit_queue.enqueue(payload, COL_LOGS)
+
+def archive_plant(user_id: str, plant_snapshot, cause: str = "manual", ts: str | None = None, batch=None):
     """Archive current plant into archived_entries for compliance (soft-delete pattern)."""
     if plant_snapshot and plant_snapshot.exists:
         data = plant_snapshot.to_dict()
         archive_doc = {
             "type": "dopamine_plant",
             "user_id": user_id,
-            "archived_at": now_iso(),
+            "archived_at": ts or now_iso(),
             "cause": cause,
             "payload": data,
         }
-        db.collection(COL_ARCH).add(archive_doc)
+        if batch is not None:
+            batch.set(db.collection(COL_ARCH).document(), archive_doc)
+        else:
+            db.collection(COL_ARCH).add(archive_doc)
 
 def should_advance(phase: int, tasks_since: int) -> bool:
     threshold = ADVANCE_THRESHOLDS.get(phase)
@@ -117,105 +163,119 @@ def pick_next_variant(current_phase: int, current_variant: str) -> tuple[int, st
     """Return (next_phase, next_variant). Phase 4 is terminal."""
     if current_phase >= 4:
         return current_phase, current_variant
-    if current_phase == 1:
-        return 2, random.choice(PHASE_BRANCHES["1"])
-    # From phase 2 or 3 we branch using current variant
-    next_choices = PHASE_BRANCHES.get(current_variant, [])
+    # Phase 1 branches from "1"; phases 2 and 3 branch using current variant
+    next_choices = PHASE_BRANCHES.get("1" if current_phase == 1 else current_variant)
     if not next_choices:
         # Safety fallback: stay put if mapping missing
         return current_phase, current_variant
-    next_phase = current_phase + 1
-    return next_phase, random.choice(next_choices)
-
-def init_payload(user_id: str):
-    return {
-        "user_id": user_id,
-        "phase": 1,
-        "variant": "POT",
-        "tasks_completed_since_phase": 0,
-        "asset_filename": manifest_lookup(1, "POT"),
-        "last_updated": now_iso(),
-    }
-
-def _require_uid_from_bearer() -> str:
-    authz = request.headers.get("Authorization", "")
-    if not authz.startswith("Bearer "):
-        raise ValueError("Missing or invalid Authorization header")
-    token = authz.split(" ", 1)[1]
-    return fb_auth.verify_id_token(token)["uid"]
-# -------------------------- Routes ----------------------------
-
-@dopamine_bp.errorhandler(ValidationError)
-def on_validation_error(err):
-    return jsonify({"error": "validation_error", "details": err.messages}), 400
-
-
-@dopamine_bp.route("/init", methods=["POST"])
-def init_plant():
-    """Create or ensure an active plant at Phase 1 for a user."""
-    if db is None:
-        return jsonify({"error": "firestore_uninitialized"}), 500
-
-    payload = InitSchema().load(request.get_json(force=True))
-    user_id = payload["user_id"]
-    ref = plant_doc_ref(user_id)
-    snap = ref.get()
-
-    if snap.exists:
-        # Idempotent: if already created, return existing
-        doc = snap.to_dict()
-        return jsonify({"ok": True, "plant": doc, "idempotent": True}), 200
+    # every branch is a 2-tuple, so one random bit picks it
+    return current_phase + 1, next_choices[random.getrandbits(1)]
+
+_INIT_TEMPLATE = {
+    "phase": 1,
+    "variant": "POT",
+    "tasks_completed_since_phase": 0,
+    "asset_filename": _INIT_ASSET,
+}
 
-    doc = init_payload(user_id)
-    ref.set(doc)
+def init_payload(user_id: str, ts: str | None = None):
+    doc = _INIT_TEMPLATE.copy()
+    doc["user_id"] = user_id
+    doc["last_updated"] = ts or now_iso()
+    return doc
+
+def _claim_task(user_id: str, task_id: str):
+    """None if this request now owns the completion, else the earlier result (or _PENDING)."""
+    key = (user_id, task_id)
+    with _state_lock:
+        prior = _recent_tasks.get(key)
+        if prior is None:
+            _recent_tasks[key] = _PENDING
+        return prior
+
+def _release_task(user_id: str, task_id: str) -> None:
+    with _state_lock:
+        _recent_tasks.pop((user_id, task_id), None)
+
+def _remember_task(user_id: str, task_id: str, plant: dict) -> None:
+    with _state_lock:
+        _recent_tasks[(user_id, task_id)] = plant
+
+def _cached_state(user_id: str) -> dict | None:
+    with _state_lock:
+        return _state_cache.get(user_id)
+
+def _cache_state(user_id: str, plant: dict) -> None:
+    with _state_lock:
+        _state_cache[user_id] = plant
+
+def _drop_state(user_id: str) -> None:
+    with _state_lock:
+        _state_cache.pop(user_id, None)
+
+def _queue_task_logs(batch, user_id: str, task_id, points: int, plant: dict, ts: str) -> None:
+    """task_completed event log + dopamine log for one completed task, queued into `batch`."""
     log_entry({
         "user_id": user_id,
-        "event_type": "plant_init",
-        "phase_after": doc["phase"],
-        "variant_after": doc["variant"],
-        "created_at": now_iso(),
+        "event_type": "task_completed",
+        "task_id": task_id,
+        "points": points,
+        "phase": plant["phase"],
+        "variant": plant["variant"],
+        "created_at": ts,
+    }, batch)
+    _, _, dopa_ops = dopa_log_ops(user_id, {
+        "points": points,  # usually 1
+        "source": "plant_task_completed",
+        "context": {"taskId": task_id},
+        "note": f"Phase {plant['phase']} variant {plant['variant']}",
     })
-    return jsonify({"ok": True, "plant": doc}), 201
-
-
-@dopamine_bp.route("/state", methods=["GET"])
-def get_state():
-    """Read current plant state."""
-    if db is None:
-        return jsonify({"error": "firestore_uninitialized"}), 500
-
-    args = StateQuerySchema().load(request.args)
-    user_id = args["user_id"]
+    for op in dopa_ops:
+        op(batch)
+
+def _increment_tasks(ref, user_id: str, cached: dict, task_id, points: int, ts: str) -> dict | None:
+    """
+    Task completion that can't cross a phase boundary: a server-side Increment
+    plus the logs in one batch, no read or transaction. None if the plant doc
+    is gone (caller falls back to the transactional path).
+    """
+    plant = dict(cached)
+    plant["tasks_completed_since_phase"] = int(plant.get("tasks_completed_since_phase", 0)) + 1
+    plant["last_updated"] = ts
+    try:
+        commit_batched([
+            lambda b: b.update(ref, {"tasks_completed_since_phase": Increment(1), "last_updated": ts}),
+            lambda b: _queue_task_logs(b, user_id, task_id, points, plant, ts),
+        ])
+    except NotFound:
+        _drop_state(user_id)
+        return None
+    return plant
+
+def _complete_task(user_id: str, task_id, points: int, ts: str) -> tuple[dict, bool]:
+    """Count one completed task (advancing the plant when due); returns (plant, advanced)."""
     ref = plant_doc_ref(user_id)
-    snap = ref.get()
-    if not snap.exists:
-        return jsonify({"error": "not_found", "message": "Plant not initialized."}), 404
-    return jsonify({"ok": True, "plant": snap.to_dict()}), 200
 
-
-@dopamine_bp.route("/task-complete", methods=["POST"])
-def task_complete():
-    """Log a completed task, possibly advance the plant. Uses a transaction for concurrency safety."""
-    if db is None:
-        return jsonify({"error": "firestore_uninitialized"}), 500
-
-    req = TaskCompleteSchema().load(request.get_json(force=True))
-    user_id = req["user_id"]
-    task_id = req.get("task_id")
-    points  = req.get("points", 1)
-
-    ref = plant_doc_ref(user_id)
+    # Fast path: cached state says this completion can't advance the phase, so
+    # the counter is bumped server-side without reading the doc. A stale cache
+    # only delays an advance to the next completion (should_advance uses >=).
+    cached = _cached_state(user_id)
+    if cached is not None and not should_advance(
+        cached["phase"], int(cached.get("tasks_completed_since_phase", 0)) + 1
+    ):
+        plant = _increment_tasks(ref, user_id, cached, task_id, points, ts)
+        if plant is not None:
+            _cache_state(user_id, plant)
+            return plant, False
 
     @firestore.transactional
     def tx_update(transaction):
-        snap = ref.get(transaction=transaction)
+        snap = ref.get(field_paths=_TX_READ_FIELDS, transaction=transaction)
         if not snap.exists:
-            # auto-init if missing (idempotent behavior)
-            doc = init_payload(user_id)
-            ref.set(doc)
-            current = doc
+            # auto-init if missing (idempotent behavior); written by the transaction.set below
+            current = init_payload(user_id, ts)
         else:
-            current = snap.to_dict()
+            current = {"user_id": user_id, **snap.to_dict()}
 
         # Increment counter
         tasks_since = int(current.get("tasks_completed_since_phase", 0)) + 1
@@ -233,43 +293,140 @@ def task_complete():
                     "variant_before": current["variant"],
                     "phase_after": new_phase,
                     "variant_after": new_variant,
-                    "created_at": now_iso(),
-                })
+                    "created_at": ts,
+                }, transaction)
                 # Apply advance
                 current["phase"] = new_phase
                 current["variant"] = new_variant
                 current["tasks_completed_since_phase"] = 0
                 advanced = True
 
-        # Always log the task completion (immutable)
-        log_entry({
-            "user_id": user_id,
-            "event_type": "task_completed",
-            "task_id": task_id,
-            "points": points,
-            "phase": current["phase"],
-            "variant": current["variant"],
-            "created_at": now_iso(),
-        })
+        # Always log the task completion (immutable) + the dopamine log for it
+        _queue_task_logs(transaction, user_id, task_id, points, current, ts)
 
         # Update asset & timestamp
         current["asset_filename"] = manifest_lookup(current["phase"], current["variant"])
-        current["last_updated"] = now_iso()
+        current["last_updated"] = ts
 
-        transaction.set(ref, current)
+        # plant update + logs + dopamine log commit together in one RPC
+        if snap.exists:
+            transaction.update(ref, {k: current[k] for k in _TX_WRITE_FIELDS})
+        else:
+            transaction.set(ref, current)
         return current, advanced
 
     transaction = db.transaction()
     plant, advanced = tx_update(transaction)
+    _cache_state(user_id, plant)
+    return plant, advanced
 
-    # Always write a log for the task that drove the event
-    create_dopa_log(user_id, {
-        "points": points,  # usually 1
-        "source": "plant_task_completed",
-        "context": {"taskId": task_id},
-        "note": f"Phase {plant['phase']} variant {plant['variant']}",
+def _require_uid_from_bearer() -> str:
+    # cached, locally verified (see backend.auth_cache / backend.jwt_verify)
+    return require_uid()
+
+def _unauthorized():
+    return jsonify({"error": "unauthorized", "message": "Missing or invalid bearer token."}), 401
+
+def _check_claimed_user(req: dict, user_id: str):
+    """403 response if the request names a different user than the token, else None."""
+    claimed = req.get("user_id")
+    if claimed is not None and claimed != user_id:
+        return jsonify({"error": "forbidden", "message": "user_id does not match the signed-in user."}), 403
+    return None
+
+# -------------------------- Routes ----------------------------
+
+@dopamine_bp.errorhandler(ValidationError)
+def on_validation_error(err):
+    return jsonify({"error": "validation_error", "details": err.messages}), 400
+
+
+@dopamine_bp.route("/init", methods=["POST"])
+def init_plant():
+    """Create or ensure an active plant at Phase 1 for a user."""
+    try:
+        user_id = _require_uid_from_bearer()
+    except Exception:
+        return _unauthorized()
+    payload = _INIT_SCHEMA.load(request.get_json(force=True, silent=True) or {})
+    denied = _check_claimed_user(payload, user_id)
+    if denied:
+        return denied
+    ref = plant_doc_ref(user_id)
 
+    # create() is a server-side "create if absent": a new user costs one RPC,
+    # and an existing plant comes back as AlreadyExists instead of needing a read first.
+    ts = now_iso()
+    doc = init_payload(user_id, ts)
+    try:
+        ref.create(doc)
+    except AlreadyExists:
+        # Idempotent: if already created, return existing
+        doc = ref.get().to_dict()
+        _cache_state(user_id, doc)
+        return jsonify({"ok": True, "plant": doc, "idempotent": True}), 200
+    _cache_state(user_id, doc)
+    log_entry({
+        "user_id": user_id,
+        "event_type": "plant_init",
+        "phase_after": doc["phase"],
+        "variant_after": doc["variant"],
+        "created_at": ts,
     })
+    return jsonify({"ok": True, "plant": doc}), 201
+
+
+@dopamine_bp.route("/state", methods=["GET"])
+def get_state():
+    """Read current plant state."""
+    try:
+        user_id = _require_uid_from_bearer()
+    except Exception:
+        return _unauthorized()
+    args = _STATE_SCHEMA.load(request.args)
+    denied = _check_claimed_user(args, user_id)
+    if denied:
+        return denied
+    plant = _cached_state(user_id)
+    if plant is None:
+        snap = plant_doc_ref(user_id).get(field_paths=_STATE_FIELDS)
+        if not snap.exists:
+            return jsonify({"error": "not_found", "message": "Plant not initialized."}), 404
+        plant = snap.to_dict()
+        _cache_state(user_id, plant)
+    return jsonify({"ok": True, "plant": plant}), 200
+
+
+@dopamine_bp.route("/task-complete", methods=["POST"])
+def task_complete():
+    """Log a completed task, possibly advance the plant. Uses a transaction for concurrency safety."""
+    try:
+        user_id = _require_uid_from_bearer()
+    except Exception:
+        return _unauthorized()
+    req = _TASK_SCHEMA.load(request.get_json(force=True, silent=True) or {})
+    denied = _check_claimed_user(req, user_id)
+    if denied:
+        return denied
+    task_id = req.get("task_id")
+    points  = req.get("points", 1)
+    ts = now_iso()  # shared by the plant doc and every log this request writes
+
+    # a repeat of a task this process just completed (double tap) is answered from memory
+    if task_id is not None:
+        prior = _claim_task(user_id, task_id)
+        if prior is _PENDING:
+            return jsonify({"error": "conflict", "message": "This task completion is already in progress."}), 409
+        if prior is not None:
+            return jsonify({"ok": True, "advanced": False, "plant": prior, "deduped": True}), 200
+    try:
+        plant, advanced = _complete_task(user_id, task_id, points, ts)
+    except Exception:
+        if task_id is not None:
+            _release_task(user_id, task_id)  # let a retry through
+        raise
+    if task_id is not None:
+        _remember_task(user_id, task_id, plant)
 
     return jsonify({
         "ok": True,
@@ -281,75 +438,83 @@ def task_complete():
 @dopamine_bp.route("/reset", methods=["POST"])
 def reset():
     """Archive current plant and reinitialize to Phase 1."""
-    if db is None:
-        return jsonify({"error": "firestore_uninitialized"}), 500
-
-    req = ResetSchema().load(request.get_json(force=True))
-    user_id = req["user_id"]
+    try:
+        user_id = _require_uid_from_bearer()
+    except Exception:
+        return _unauthorized()
+    req = _RESET_SCHEMA.load(request.get_json(force=True, silent=True) or {})
+    denied = _check_claimed_user(req, user_id)
+    if denied:
+        return denied
     reason  = req.get("reason") or "reset"
+    ts = now_iso()
 
     ref = plant_doc_ref(user_id)
     snap = ref.get()
-    archive_plant(user_id, snap, cause=reason)
+    doc = init_payload(user_id, ts)
 
-    doc = init_payload(user_id)
-    ref.set(doc)
-    # after ref.set(doc)
-    create_dopa_log(user_id, {
+    # one dopamine log per reset; archive + re-init + both logs commit in one batch
+    _, _, dopa_ops = dopa_log_ops(user_id, {
         "points": 0,
         "source": "plant_reset",
-        "context": {},
-        "note": "Plant initialized",
-    })
-
-    log_entry({
-        "user_id": user_id,
-        "event_type": "plant_reset",
-        "reason": reason,
-        "phase_after": doc["phase"],
-        "variant_after": doc["variant"],
-        "created_at": now_iso(),
-    })
-
-    create_dopa_log(user_id, {
-        "points": 0,
-        "source": "plant_reset",
-        "context": {},
-        "note": reason or "reset",
+        "context": {"reason": reason, "phase_after": doc["phase"], "variant_after": doc["variant"]},
+        "note": reason,
     })
+    commit_batched([
+        lambda b: archive_plant(user_id, snap, cause=reason, ts=ts, batch=b),
+        lambda b: b.set(ref, doc),
+        lambda b: log_entry({
+            "user_id": user_id,
+            "event_type": "plant_reset",
+            "reason": reason,
+            "phase_after": doc["phase"],
+            "variant_after": doc["variant"],
+            "created_at": ts,
+        }, b),
+        *dopa_ops,
+    ])
+    _cache_state(user_id, doc)
     return jsonify({"ok": True, "plant": doc}), 200
 
 
 @dopamine_bp.route("/delete", methods=["DELETE"])
 def delete_plant():
     """Archive then permanently delete the active plant doc."""
-    if db is None:
-        return jsonify({"error": "firestore_uninitialized"}), 500
-
     try:
-        req = StateQuerySchema().load(request.args or request.get_json(silent=True) or {})
+        user_id = _require_uid_from_bearer()
+    except Exception:
+        return _unauthorized()
+    try:
+        req = _STATE_SCHEMA.load(request.args or request.get_json(force=True, silent=True) or {})
     except ValidationError as err:
         return jsonify({"error": "validation_error", "details": err.messages}), 400
+    denied = _check_claimed_user(req, user_id)
+    if denied:
+        return denied
 
-    user_id = req["user_id"]
     ref = plant_doc_ref(user_id)
     snap = ref.get()
 
     if not snap.exists:
         return jsonify({"ok": True, "deleted": False, "message": "Nothing to delete."}), 200
 
-    archive_plant(user_id, snap, cause="delete")
-    ref.delete()
-    log_entry({
-        "user_id": user_id,
-        "event_type": "plant_deleted",
-        "created_at": now_iso(),
-    })
-
-    create_dopa_log(user_id, {
+    ts = now_iso()
+    _, _, dopa_ops = dopa_log_ops(user_id, {
         "points": 0,
         "source": "plant_deleted",
         "context": {},
         "note": "Archived then deleted",
     })
+    # archive + delete + both logs in one atomic commit
+    commit_batched([
+        lambda b: archive_plant(user_id, snap, cause="delete", ts=ts, batch=b),
+        lambda b: b.delete(ref),
+        lambda b: log_entry({
+            "user_id": user_id,
+            "event_type": "plant_deleted",
+            "created_at": ts,
+        }, b),
+        *dopa_ops,
+    ])
+    _drop_state(user_id)
     return jsonify({"ok": True, "deleted": True}), 200
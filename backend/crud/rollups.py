@@ -0,0 +1,86 @@
+# backend/crud/rollups.py
+# Daily counter docs that back the admin analytics summaries.
+# Writers add the returned (ref, data) pairs to the same write as the doc they
+# touch (always with merge=True). When the deltas depend on the stored doc
+# (`prev`), read it in a transaction and write there, or two concurrent writes
+# can both see "not counted today" and double count. admin_analytics then reads
+# the small rollup rows instead of scanning every user/task in the window.
+#
+# Counts are "active per day": a user/task is counted once per UTC day in the
+# group it ended that day in, so multi-day windows count user-days/task-days.
+from __future__ import annotations
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from google.cloud.firestore_v1 import Increment  # type: ignore
+from backend.client import db  # type: ignore
+
+USERS_ROLLUP = "users_daily_rollup"  # {date, consented, country, ageBracket, count}
+TASKS_ROLLUP = "tasks_daily_rollup"  # {date, state, count}
+DOPAMINE_TOTALS = "dopamine_totals"  # users/{uid}/dopamine_totals/{date}: {date, total, count, bySource}
+
+RollupWrite = Tuple[Any, Dict[str, Any]]
+
+def day_key(dt: Optional[datetime] = None) -> str:
+    return (dt or datetime.now(timezone.utc)).astimezone(timezone.utc).date().isoformat()
+
+def _bucket(v: Optional[str]) -> str:
+    return (v or "unknown").lower()
+
+def _doc_id(*parts: Any) -> str:
+    return "_".join(str(p).replace("/", "-") for p in parts)
+
+def _touched_today(prev: Dict[str, Any], today: str) -> bool:
+    ts = prev.get("updatedAt")
+    return isinstance(ts, datetime) and day_key(ts) == today
+
+def _user_write(day: str, group: Tuple[bool, str, str], delta: int) -> RollupWrite:
+    consented, country, age = group
+    ref = db.collection(USERS_ROLLUP).document(_doc_id(day, int(consented), country, age))  # type: ignore
+    return ref, {"date": day, "consented": consented, "country": country, "ageBracket": age, "count": Increment(delta)}
+
+def _task_write(day: str, state: str, delta: int) -> RollupWrite:
+    ref = db.collection(TASKS_ROLLUP).document(_doc_id(day, state))  # type: ignore
+    return ref, {"date": day, "state": state, "count": Increment(delta)}
+
+def user_rollup_writes(prev: Dict[str, Any], cur: Dict[str, Any]) -> List[RollupWrite]:
+    """`prev` is the stored user doc ({} if new); `cur` is prev merged with the pending write."""
+    def group(u: Dict[str, Any]) -> Tuple[bool, str, str]:
+        return (u.get("marketingConsent") is True, _bucket(u.get("country")), _bucket(u.get("ageBracket")))
+
+    today = day_key()
+    new = group(cur)
+    if not _touched_today(prev, today):
+        return [_user_write(today, new, 1)]
+    old = group(prev)
+    if old == new:
+        return []
+    return [_user_write(today, old, -1), _user_write(today, new, 1)]
+
+def task_rollup_writes(prev: Dict[str, Any], cur: Dict[str, Any]) -> List[RollupWrite]:
+    """Same contract as user_rollup_writes, grouped by task state."""
+    today = day_key()
+    new = cur.get("state") or "unknown"
+    if not _touched_today(prev, today):
+        return [_task_write(today, new, 1)]
+    old = prev.get("state") or "unknown"
+    if old == new:
+        return []
+    return [_task_write(today, old, -1), _task_write(today, new, 1)]
+
+def new_task_rollup_writes(states: Iterable[Optional[str]]) -> List[RollupWrite]:
+    """One Increment per state for a bulk insert of brand-new tasks."""
+    today = day_key()
+    return [_task_write(today, st, n) for st, n in Counter(s or "unknown" for s in states).items()]
+
+def dopamine_totals_ref(uid: str, day: str):
+    return db.collection("users").document(uid).collection(DOPAMINE_TOTALS).document(day)  # type: ignore
+
+def dopamine_total_write(uid: str, day: str, source: str, points: int, delta: int = 1) -> RollupWrite:
+    """Add (delta=1) or remove (delta=-1) one log of `points` from the user's `day` totals."""
+    return dopamine_totals_ref(uid, day), {
+        "date": day,
+        "total": Increment(delta * points),
+        "count": Increment(delta),
+        "bySource": {source: Increment(delta * points)},
+    }
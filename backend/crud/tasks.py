@@ -1,9 +1,14 @@
 # backend/api/tasks.py
 from __future__ import annotations
-from typing import Any, Dict, List, Optional, Tuple
-from flask import Blueprint, request, jsonify, current_app, Response
-from firebase_admin import auth as fb_auth
+from datetime import datetime
+from itertools import chain
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+from firebase_admin import firestore  # type: ignore
+from backend.auth import require_uid
 from backend.client import db, SERVER_TS  # type: ignore
+from backend.crud.rollups import task_rollup_writes
+from backend.crud.utils import encode_page_token, decode_page_token, stream_json_array, stream_query
 
 bp = Blueprint("tasks", __name__)
 COL = "tasks"
@@ -11,8 +16,14 @@ COL = "tasks"
 # ---------------------------------------------------------------------------
 # Settings / enums (align with frontend)
 # ---------------------------------------------------------------------------
-ALLOWED_STATES = {"Exploring", "Planning", "Doing", "Done"}  # keep in sync with RN
-ALLOWED_ORDER = {"createdAt", "updatedAt", "priority", "dueDate"}
+ALLOWED_STATES = frozenset({"Exploring", "Planning", "Doing", "Done"})  # keep in sync with RN
+ALLOWED_ORDER = frozenset({"createdAt", "updatedAt", "priority", "dueDate"})
+_STATE_ERROR = f"state must be one of {sorted(ALLOWED_STATES)}"  # built once, not per bad request
+
+# copied through as-is by update_task
+_UPDATABLE_FIELDS = frozenset({"notes", "priority", "dueDate", "isArchived"})
+# orderings whose field is a timestamp, so a page can resume from a pageToken
+_TOKEN_ORDERS = frozenset({"createdAt", "updatedAt"})
 
 # ---------------------------------------------------------------------------
 # Helpers
@@ -21,18 +32,25 @@ def _err(msg: str, code: int) -> Tuple[Response, int]:
     return jsonify({"error": msg}), code
 
 def _require_auth_uid() -> str:
-    authz = request.headers.get("Authorization", "")
-    if not authz.startswith("Bearer "):
-        raise ValueError("Missing or invalid Authorization header")
-    token = authz.split(" ", 1)[1]
-    decoded = fb_auth.verify_id_token(token)
-    return decoded["uid"]
+    return require_uid()
 
 def _serialize_doc(snap) -> Dict[str, Any]:
     data = snap.to_dict()
     data["id"] = snap.id
     return data
 
+def _echo_write(doc_id: str, data: Dict[str, Any], commit_time: datetime) -> Dict[str, Any]:
+    # the doc as stored, without reading it back: SERVER_TS fields resolve to the commit time
+    d = {k: (commit_time if v is SERVER_TS else v) for k, v in data.items()}
+    d["id"] = doc_id
+    return d
+
+def _with_page_token(d: Dict[str, Any], order_by: str) -> Dict[str, Any]:
+    # pass the last item's pageToken back as ?startAfter= to resume after it
+    if isinstance(d.get(order_by), datetime):
+        d["pageToken"] = encode_page_token(d[order_by], d["id"])
+    return d
+
 def _coerce_int(v: Optional[str], default: int, lo: int = 1, hi: int = 100) -> int:
     try:
         if v is None:
@@ -52,7 +70,7 @@ def create_task(uid: str, data: Dict[str, Any]) -> Dict[str, Any]:
 
     state = data.get("state", "Exploring")
     if state not in ALLOWED_STATES:
-        raise ValueError(f"state must be one of {sorted(ALLOWED_STATES)}")
+        raise ValueError(_STATE_ERROR)
 
     payload: Dict[str, Any] = {
         "userId": uid,
@@ -67,9 +85,12 @@ def create_task(uid: str, data: Dict[str, Any]) -> Dict[str, Any]:
     }
 
     ref = db.collection(COL).document()  # type: ignore
-    ref.set(payload)                     # type: ignore
-    snap = ref.get()
-    return _serialize_doc(snap)
+    batch = db.batch()                   # type: ignore
+    batch.set(ref, payload)
+    for rollup_ref, rollup in task_rollup_writes({}, payload):
+        batch.set(rollup_ref, rollup, merge=True)
+    result = batch.commit()[0]
+    return _echo_write(ref.id, payload, result.update_time)
 
 def get_task(uid: str, task_id: str) -> Optional[Dict[str, Any]]:
     snap = db.collection(COL).document(task_id).get()  # type: ignore
@@ -80,14 +101,19 @@ def get_task(uid: str, task_id: str) -> Optional[Dict[str, Any]]:
         return "forbidden"  # sentinel
     return _serialize_doc(snap)
 
-def update_task(uid: str, task_id: str, updates: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-    ref = db.collection(COL).document(task_id)  # type: ignore
-    snap = ref.get()
+@firestore.transactional
+def _update_in_transaction(transaction, uid: str, ref, updates: Dict[str, Any]):
+    """
+    Read, validate and write the task plus its rollup deltas in one transaction,
+    so concurrent updates can't both see "not counted today" and double count.
+    Returns (None | "forbidden" | stored doc, merged doc or None if nothing was written).
+    """
+    snap = ref.get(transaction=transaction)
     if not snap.exists:
-        return None
+        return None, None
     current = snap.to_dict()
     if current.get("userId") != uid:
-        return "forbidden"
+        return "forbidden", None
 
     write: Dict[str, Any] = {}
     if "title" in updates:
@@ -99,19 +125,27 @@ def update_task(uid: str, task_id: str, updates: Dict[str, Any]) -> Optional[Dic
     if "state" in updates:
         state = updates.get("state")
         if state not in ALLOWED_STATES:
-            raise ValueError(f"state must be one of {sorted(ALLOWED_STATES)}")
+            raise ValueError(_STATE_ERROR)
         write["state"] = state
 
-    for k in ("notes", "priority", "dueDate", "isArchived"):
-        if k in updates:
-            write[k] = updates.get(k)
+    write.update({k: updates[k] for k in _UPDATABLE_FIELDS & updates.keys()})
 
     if not write:
-        return _serialize_doc(snap)  # no-op
+        return _serialize_doc(snap), None  # no-op
 
     write["updatedAt"] = SERVER_TS  # type: ignore
-    ref.set(write, merge=True)
-    return _serialize_doc(ref.get())
+    transaction.set(ref, write, merge=True)
+    for rollup_ref, rollup in task_rollup_writes(current, {**current, **write}):
+        transaction.set(rollup_ref, rollup, merge=True)
+    return current, {**current, **write}
+
+def update_task(uid: str, task_id: str, updates: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    ref = db.collection(COL).document(task_id)  # type: ignore
+    transaction = db.transaction()  # type: ignore
+    result, merged = _update_in_transaction(transaction, uid, ref, updates)
+    if merged is None:
+        return result
+    return _echo_write(task_id, merged, transaction.write_results[0].update_time)
 
 def delete_task(uid: str, task_id: str) -> str | None:
     ref = db.collection(COL).document(task_id)  # type: ignore
@@ -123,7 +157,7 @@ def delete_task(uid: str, task_id: str) -> str | None:
     ref.delete()
     return task_id
 
-def list_tasks(
+def iter_tasks(
     uid: str,
     state: Optional[str],
     order_by: str,
@@ -131,13 +165,13 @@ def list_tasks(
     start_after: Optional[str],
     due_before: Optional[str],
     due_after: Optional[str],
-) -> List[Dict[str, Any]]:
+) -> Iterator[Dict[str, Any]]:
     # base query
     q = db.collection(COL).where("userId", "==", uid)  # type: ignore
 
     if state:
         if state not in ALLOWED_STATES:
-            raise ValueError(f"state must be one of {sorted(ALLOWED_STATES)}")
+            raise ValueError(_STATE_ERROR)
         q = q.where("state", "==", state)
 
     # range filters on dueDate (if client sends them)
@@ -149,15 +183,36 @@ def list_tasks(
     # order and pagination
     if order_by not in ALLOWED_ORDER:
         order_by = "createdAt"
-    q = q.order_by(order_by)
+    if due_before or due_after:
+        # a range filter is served from the (userId[, state], dueDate) index only
+        # when the results are ordered by that same field
+        order_by = "dueDate"
+    q = q.order_by(order_by).order_by("__name__")  # doc id breaks ties for stable pages
 
     if start_after:
-        last = db.collection(COL).document(start_after).get()  # type: ignore
-        if last.exists:
-            q = q.start_after(last)
+        cursor = decode_page_token(start_after)
+        if cursor and order_by in _TOKEN_ORDERS:
+            # resume from the values in the token; no cursor-doc read
+            value, doc_id = cursor
+            q = q.start_after({order_by: value, "__name__": doc_id})
+        else:  # plain doc id from older clients
+            last = db.collection(COL).document(cursor[1] if cursor else start_after).get()  # type: ignore
+            if last.exists:
+                q = q.start_after(last)
 
     q = q.limit(limit)
-    return [_serialize_doc(d) for d in q.stream()]  # type: ignore
+    return (_with_page_token(_serialize_doc(d), order_by) for d in stream_query(q, "tasks.list"))
+
+def list_tasks(
+    uid: str,
+    state: Optional[str],
+    order_by: str,
+    limit: int,
+    start_after: Optional[str],
+    due_before: Optional[str],
+    due_after: Optional[str],
+) -> List[Dict[str, Any]]:
+    return list(iter_tasks(uid, state, order_by, limit, start_after, due_before, due_after))
 
 # ---------------------------------------------------------------------------
 # Routes
@@ -251,13 +306,15 @@ def list_tasks_http():
     limit = _coerce_int(request.args.get("limit"), default=50, lo=1, hi=100)
 
     try:
-        items = list_tasks(uid, state, order_by, limit, start_after, due_before, due_after)
-        return jsonify(items), 200
+        items = iter_tasks(uid, state, order_by, limit, start_after, due_before, due_after)
+        first = next(items, None)  # surface query errors as a 500 before streaming starts
     except ValueError as ve:
         return _err(str(ve), 400)
     except Exception as e:
         current_app.logger.exception(e)
         return _err("Internal error", 500)
+    body = chain((first,), items) if first is not None else ()
+    return Response(stream_with_context(stream_json_array(body)), 200, mimetype="application/json")
 
 # --- registration hook expected by app.py ---
 def register_task_routes(app):
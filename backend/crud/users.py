@@ -1,24 +1,31 @@
 # backend/api/users.py
 from __future__ import annotations
-from typing import Any, Dict, List, Optional, Tuple
-from flask import Blueprint, request, jsonify, current_app, Response
-from firebase_admin import auth as fb_auth
+from datetime import datetime
+from itertools import chain
+from typing import Any, Dict, Iterator, Optional, Tuple
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+from firebase_admin import firestore  # type: ignore
+from backend import audit_queue
+from backend.auth import require_decoded_token
 from backend.client import db, SERVER_TS  # type: ignore
+from backend.crud.rollups import user_rollup_writes
+from backend.crud.utils import stream_json_array, stream_query
 
 bp = Blueprint("users", __name__)
 COL = "users"
 AUDIT_COL = "activity_logs"
 
+# admin_list_users field sets
+_BASE_FIELDS = frozenset({"uid", "displayName", "createdAt", "lastSignIn"})
+_OPTIONAL_FIELDS = frozenset({"country", "ageBracket"})
+_PII_EMAIL = frozenset({"email"})
+
 # ----------------------- helpers -----------------------
 def _err(msg: str, code: int) -> Tuple[Response, int]:
     return jsonify({"error": msg}), code
 
 def _require_decoded_token() -> Dict[str, Any]:
-    authz = request.headers.get("Authorization", "")
-    if not authz.startswith("Bearer "):
-        raise ValueError("Missing or invalid Authorization header")
-    token = authz.split(" ", 1)[1]
-    return fb_auth.verify_id_token(token)
+    return require_decoded_token()
 
 def _require_auth_uid() -> str:
     return _require_decoded_token()["uid"]
@@ -34,18 +41,30 @@ def _serialize_doc(snap) -> Dict[str, Any]:
     data["id"] = snap.id
     return data
 
+def _echo_write(doc_id: str, data: Dict[str, Any], commit_time: datetime) -> Dict[str, Any]:
+    # the doc as stored, without reading it back: SERVER_TS fields resolve to the commit time
+    d = {k: (commit_time if v is SERVER_TS else v) for k, v in data.items()}
+    d["id"] = doc_id
+    return d
+
 def _audit(uid: str, action: str, details: Dict[str, Any]) -> None:
-    db.collection(AUDIT_COL).document().set({  # type: ignore
+    # batched off the request path by audit_queue's worker thread
+    audit_queue.enqueue({
         "userId": uid,
         "action": action,
         "details": details,
         "timestamp": SERVER_TS,  # type: ignore
-    })
+    }, AUDIT_COL)
 
 # ----------------------- core ops -----------------------
-def create_or_update_user(uid: str, data: Dict[str, Any]) -> Dict[str, Any]:
-    ref = db.collection(COL).document(uid)  # type: ignore
-    snap = ref.get()
+@firestore.transactional
+def _upsert_in_transaction(transaction, ref, uid: str, data: Dict[str, Any]):
+    """
+    Read the user and write it plus its rollup deltas in one transaction, so
+    concurrent writes can't both see "not counted today". Returns (prev, payload).
+    """
+    snap = ref.get(transaction=transaction)
+    prev = snap.to_dict() if snap.exists else {}
     payload: Dict[str, Any] = {
         "uid": uid,
         "email": data.get("email"),
@@ -65,8 +84,16 @@ def create_or_update_user(uid: str, data: Dict[str, Any]) -> Dict[str, Any]:
     for k in ("country", "ageBracket"):
         if k in data:
             payload[k] = data.get(k)
-    ref.set(payload, merge=True)
-    return _serialize_doc(ref.get())
+    transaction.set(ref, payload, merge=True)
+    for rollup_ref, rollup in user_rollup_writes(prev, {**prev, **payload}):
+        transaction.set(rollup_ref, rollup, merge=True)
+    return prev, payload
+
+def create_or_update_user(uid: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    ref = db.collection(COL).document(uid)  # type: ignore
+    transaction = db.transaction()  # type: ignore
+    prev, payload = _upsert_in_transaction(transaction, ref, uid, data)
+    return _echo_write(uid, {**prev, **payload}, transaction.write_results[0].update_time)
 
 def get_user(uid: str) -> Optional[Dict[str, Any]]:
     snap = db.collection(COL).document(uid).get()  # type: ignore
@@ -148,41 +175,45 @@ def admin_list_users():
     except Exception:
         limit = 100
     start_after = request.args.get("startAfter")
-    requested_fields = set((request.args.get("fields") or "").split(",")) if request.args.get("fields") else set()
+    fields_arg = request.args.get("fields")
+    requested_fields = set(fields_arg.split(",")) if fields_arg else set()
 
-    base_fields = {"uid", "displayName", "createdAt", "lastSignIn"}
-    optional_fields = {"country", "ageBracket"}
-    pii_email = {"email"}
-    allowed = base_fields | (requested_fields & optional_fields)
+    allowed = _BASE_FIELDS | (requested_fields & _OPTIONAL_FIELDS)
     include_email = "email" in requested_fields
 
-    q = db.collection(COL).where("marketingConsent", "==", True).order_by("uid")  # type: ignore
+    # server-side projection: only the fields this view can return cross the wire
+    fields = sorted(allowed | _PII_EMAIL) if include_email else sorted(allowed)
+    q = db.collection(COL).where("marketingConsent", "==", True).order_by("uid").select(fields)  # type: ignore
     if start_after:
-        last = db.collection(COL).document(start_after).get()  # type: ignore
-        if last.exists:
-            q = q.start_after(last)
+        # docs are keyed by uid and ordered by it, so the cursor is just the value (no doc read)
+        q = q.start_after({"uid": start_after})
     q = q.limit(limit)
 
-    docs = list(q.stream())  # type: ignore
-    results: List[Dict[str, Any]] = []
-
-    for d in docs:
-        u = d.to_dict()
-        u["uid"] = u.get("uid", d.id)
-        view = {k: u.get(k) for k in allowed}
-        if include_email:
-            view["email"] = u.get("email")  # consider hashing if you don't need raw
-        view["id"] = d.id
-        results.append(view)
-
+    # audited before any row goes out, so a dropped or failed stream is still on record
     _audit(admin_uid, "admin.users.list", {
-        "count": len(results),
         "limit": limit,
-        "requested_fields": sorted(list(requested_fields)),
+        "requested_fields": sorted(requested_fields),
         "include_email": include_email,
     })
 
-    return jsonify(results), 200
+    def _views() -> Iterator[Dict[str, Any]]:
+        for d in stream_query(q, "users.admin_list"):
+            u = d.to_dict()
+            u["uid"] = u.get("uid", d.id)
+            view = {k: u.get(k) for k in allowed}
+            if include_email:
+                view["email"] = u.get("email")  # consider hashing if you don't need raw
+            view["id"] = d.id
+            yield view
+
+    items = _views()
+    try:
+        first = next(items, None)  # surface query errors as a 500 before streaming starts
+    except Exception as e:
+        current_app.logger.exception(e)
+        return _err("Internal error", 500)
+    body = chain((first,), items) if first is not None else ()
+    return Response(stream_with_context(stream_json_array(body)), 200, mimetype="application/json")
 
 # --- registration hook expected by app.py ---
 def register_user_routes(app):
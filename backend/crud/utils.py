@@ -1,10 +1,68 @@
+import base64
+import os
+import random
 from datetime import datetime
+from typing import Any, Iterable, Iterator, Optional, Tuple, Union
+from flask import current_app
+from google.cloud.firestore_v1.query_profile import ExplainOptions
 
-def serialize(value):
-  if isinstance(value, dict):
-    return {k: serialize(v) for k, v in value.items()}
-  if isinstance(value, list):
-    return [serialize(v) for v in value]
-  if isinstance(value, datetime):
-    return value.isoformat()
-  return value
\ No newline at end of file
+# Fraction of list queries run with EXPLAIN ANALYZE (e.g. 0.01); 0/unset = off.
+# The logged plan + scan counts show large-scan/small-return queries that need an index.
+try:
+  EXPLAIN_SAMPLE = float(os.getenv("FIRESTORE_EXPLAIN_SAMPLE", "0"))
+except ValueError:
+  EXPLAIN_SAMPLE = 0.0
+
+# Opaque pagination tokens: "<createdAt iso>|<doc id>" base64url-encoded, so a
+# page can resume with start_after(field values) instead of re-reading the doc.
+def encode_page_token(ts: datetime, doc_id: str) -> str:
+  raw = f"{ts.isoformat()}|{doc_id}".encode()
+  return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_page_token(token: str) -> Optional[Tuple[datetime, str]]:
+  try:
+    raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+    ts, doc_id = raw.split("|", 1)
+    return datetime.fromisoformat(ts), doc_id
+  except Exception:
+    return None  # not a token (e.g. a legacy plain doc id)
+
+# Emit a JSON array one element at a time (wrap in stream_with_context), so a
+# list endpoint holds one doc in memory and sends its first byte immediately.
+# With the orjson provider the chunks are bytes straight from the encoder.
+def stream_json_array(items: Iterable[Any]) -> Iterator[Union[str, bytes]]:
+  dumpb = getattr(current_app.json, "dumpb", None)
+  if dumpb is None:
+    dumps = current_app.json.dumps
+    yield "["
+    sep = ""
+    for item in items:
+      yield sep + dumps(item)
+      sep = ","
+    yield "]"
+    return
+  yield b"["
+  sep = b""
+  for item in items:
+    yield sep + dumpb(item)
+    sep = b","
+  yield b"]"
+
+# q.stream(), except a sampled fraction of calls also logs the query plan and
+# execution stats once the results are exhausted.
+def stream_query(q, name: str) -> Iterator[Any]:
+  if not EXPLAIN_SAMPLE or random.random() >= EXPLAIN_SAMPLE:
+    yield from q.stream()
+    return
+  results = q.stream(explain_options=ExplainOptions(analyze=True))
+  yield from results
+  try:
+    metrics = results.get_explain_metrics()
+    stats = metrics.execution_stats
+    current_app.logger.info(
+      "firestore_plan %s returned=%d reads=%d duration=%s indexes=%s debug=%s",
+      name, stats.results_returned, stats.read_operations, stats.execution_duration,
+      metrics.plan_summary.indexes_used, stats.debug_stats,
+    )
+  except Exception:
+    current_app.logger.warning("firestore_plan %s: explain metrics unavailable", name, exc_info=True)
@@ -0,0 +1,29 @@
+# backend/gunicorn_conf.py
+# Production server config:
+#   gunicorn backend.app:app -c backend/gunicorn_conf.py
+# gthread workers let concurrent requests overlap their Firestore I/O instead of
+# queueing behind Werkzeug's dev server.
+import multiprocessing
+import os
+import threading
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5001')}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+
+# Import the app once in the master. Firebase Admin and the Firestore client
+# are created lazily on first use, and the master starts no threads: anything
+# threaded (key refresh, audit queue, warmups) starts per worker, after fork.
+preload_app = True
+
+def post_fork(server, worker):
+    # Load Google's ID-token signing keys in the background and keep them fresh,
+    # so no request waits on the cert fetch (SKIP_AUTH_WARMUP=1 to skip).
+    if not (os.getenv("SKIP_AUTH_WARMUP") or os.getenv("FIREBASE_AUTH_EMULATOR_HOST")):
+        from backend.jwt_verify import start_key_refresher
+        start_key_refresher()
+    # Each worker opens its own Firestore channel; do it now, off the request path.
+    from backend.client import warm_db
+    threading.Thread(target=warm_db, name="firestore-warmup", daemon=True).start()
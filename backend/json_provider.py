@@ -0,0 +1,39 @@
+# backend/json_provider.py
+# Flask JSON provider backed by orjson. Output matches Flask's default provider
+# (dates as RFC 822 strings, sorted keys unless sort_keys is turned off); only
+# the encoder changes. Install with `app.json = ORJSONProvider(app)`.
+from __future__ import annotations
+from typing import Any
+
+import orjson
+from flask.json.provider import DefaultJSONProvider
+
+# Datetimes (incl. Firestore's DatetimeWithNanoseconds, which orjson rejects)
+# go through Flask's `default` so they keep the HTTP-date format clients get today.
+_BASE_OPTS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+class ORJSONProvider(DefaultJSONProvider):
+    def _options(self, indent: bool = False) -> int:
+        opts = _BASE_OPTS
+        if self.sort_keys:
+            opts |= orjson.OPT_SORT_KEYS
+        if indent:
+            opts |= orjson.OPT_INDENT_2
+        return opts
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        opts = self._options(indent=bool(kwargs.get("indent")))
+        return orjson.dumps(obj, default=kwargs.get("default", self.default), option=opts).decode()
+
+    def dumpb(self, obj: Any) -> bytes:
+        """Compact UTF-8 JSON bytes, ready for a response body (no str round-trip)."""
+        return orjson.dumps(obj, default=self.default, option=self._options())
+
+    def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+        return orjson.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        body = orjson.dumps(obj, default=self.default, option=self._options(indent) | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
@@ -0,0 +1,123 @@
+# backend/jwt_verify.py
+# Local Firebase ID-token verification: PyJWT + Google's signing certs cached
+# in-process, so a verify is one RSA check instead of the SDK's cert-refresh path.
+from __future__ import annotations
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import jwt
+import requests
+from cryptography.x509 import load_pem_x509_certificate
+
+CERTS_URL = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+_DEFAULT_TTL = 3600  # Google rotates these keys roughly daily
+_MIN_REFETCH = 60    # unknown-kid refetches are throttled to one per minute
+_REFRESH_MARGIN = 300  # background refresh runs this long before the keys expire
+_MAX_AGE = re.compile(r"max-age=(\d+)")
+
+log = logging.getLogger(__name__)
+
+# Replaced wholesale by refresh_keys(), never mutated, so readers need no lock
+# and no lock is ever held across the cert fetch (a fork mid-fetch can't
+# leave a child with a held lock).
+_jwks_cache: Dict[str, Any] = {"keys": None, "exp": 0.0, "fetched": 0.0}
+_project_id: Optional[str] = None
+_refresher: Optional[threading.Thread] = None
+_refresher_lock = threading.Lock()
+
+def _resolve_project_id() -> str:
+    global _project_id
+    if _project_id is None:
+        pid = os.getenv("FIREBASE_PROJECT_ID") or os.getenv("GOOGLE_CLOUD_PROJECT")
+        if not pid:
+            # Firebase Admin is initialized lazily (backend.client), so it may not exist yet
+            import firebase_admin
+            from backend import client
+            client._init_firebase_admin()
+            pid = firebase_admin.get_app().project_id or client.PROJECT_ID
+        _project_id = pid
+    return _project_id
+
+def _fetch_keys() -> Dict[str, Any]:
+    resp = requests.get(CERTS_URL, timeout=10)
+    resp.raise_for_status()
+    m = _MAX_AGE.search(resp.headers.get("Cache-Control", ""))
+    ttl = min(int(m.group(1)), _DEFAULT_TTL) if m else _DEFAULT_TTL
+    keys = {
+        kid: load_pem_x509_certificate(pem.encode()).public_key()
+        for kid, pem in resp.json().items()
+    }
+    now = time.time()
+    return {"keys": keys, "exp": now + ttl, "fetched": now}
+
+def _public_key(kid: str, force: bool = False):
+    cache = _jwks_cache
+    now = time.time()
+    stale = cache["keys"] is None or now > cache["exp"]
+    if stale or (force and now - cache["fetched"] > _MIN_REFETCH):
+        refresh_keys()
+        cache = _jwks_cache
+    return cache["keys"].get(kid)
+
+def refresh_keys() -> None:
+    """Fetch the signing keys now (e.g. at startup) instead of on the first verify."""
+    global _jwks_cache
+    _jwks_cache = _fetch_keys()  # one assignment: readers see the old keys or the new ones
+
+def _refresh_loop() -> None:
+    while True:
+        try:
+            refresh_keys()
+            delay = max(_MIN_REFETCH, _jwks_cache["exp"] - time.time() - _REFRESH_MARGIN)
+        except Exception:
+            log.warning("jwt_verify: signing-key refresh failed; retrying", exc_info=True)
+            delay = _MIN_REFETCH
+        time.sleep(delay)
+
+def start_key_refresher() -> None:
+    """
+    Load the signing keys in the background now and keep them fresh, so no
+    request pays the cert fetch. Idempotent. Start it in the serving process
+    (gunicorn's post_fork), not at import: threads don't survive fork().
+    """
+    global _refresher
+    if _refresher is not None and _refresher.is_alive():
+        return
+    with _refresher_lock:
+        if _refresher is None or not _refresher.is_alive():
+            _refresher = threading.Thread(target=_refresh_loop, name="jwt-key-refresh", daemon=True)
+            _refresher.start()
+
+def verify_firebase_id_token(token: str) -> Dict[str, Any]:
+    """
+    Same checks and result shape as firebase_admin.auth.verify_id_token (no
+    revocation check): RS256 signature, aud/iss for this project, exp/iat, and
+    a non-empty `sub`, which is also exposed as `uid`.
+    """
+    kid = jwt.get_unverified_header(token).get("kid")
+    if not kid:
+        raise ValueError("ID token has no 'kid' header")
+    key = _public_key(kid)
+    if key is None:
+        key = _public_key(kid, force=True)  # keys rotated since our last fetch
+        if key is None:
+            raise ValueError("ID token signed with an unknown key")
+
+    project_id = _resolve_project_id()
+    claims = jwt.decode(
+        token,
+        key=key,
+        algorithms=["RS256"],
+        audience=project_id,
+        issuer=f"https://securetoken.google.com/{project_id}",
+        options={"require": ["exp", "iat", "sub"]},
+    )
+    sub = claims.get("sub")
+    if not isinstance(sub, str) or not sub or len(sub) > 128:
+        raise ValueError("ID token has an invalid 'sub' claim")
+    claims["uid"] = sub
+    return claims
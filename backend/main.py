@@ -8,8 +8,9 @@ from typing import Any, Dict, Tuple
 from flask import Flask, jsonify, request
 from flask_cors import CORS
 
-# Import initializes Firebase Admin via backend.client (credentials come from env)
+# Firebase Admin is initialized by backend.client on first Firestore use (credentials come from env)
 from backend import client  # noqa: F401
+from backend.json_provider import ORJSONProvider
 
 # Blueprints
 from backend.crud.tasks import bp as tasks_bp
@@ -17,16 +18,22 @@ from backend.crud.archived import bp as archive_bp
 from backend.crud.users import bp as users_bp
 from backend.crud.dopamine_logs import bp as dopamine_logs_bp
 from backend.crud.bootstrap import bp as bootstrap_bp
+from backend.crud.dopamine_plant import dopamine_bp
 
   
 
 def create_app() -> Flask:
     app = Flask(__name__)
+    app.json = ORJSONProvider(app)
 
     # --- Basic configuration ---
-    app.config["JSON_SORT_KEYS"] = False
-    app.config["JSONIFY_PRETTYPRINT_REGULAR"] = False
+    # (Flask 3 ignores the old JSON_SORT_KEYS / JSONIFY_PRETTYPRINT_REGULAR keys;
+    # the provider attributes are what take effect)
+    app.json.sort_keys = False
+    app.json.compact = True
     app.config["MAX_CONTENT_LENGTH"] = 2 * 1024 * 1024  # 2MB safety limit
+    # "/tasks/" serves the same view as "/tasks" instead of a 308 redirect round trip
+    app.url_map.strict_slashes = False
 
     # --- CORS ---
     # In prod, restrict to your frontend origins:
@@ -49,7 +56,7 @@ def create_app() -> Flask:
 
     @app.get("/healthz")
     def healthz() -> Tuple[Any, int]:
-        # If Firebase Admin init failed at import time, requests would fail anyway.
+        # Firebase Admin init happens on first Firestore use; a failure there surfaces as a 500 on that request.
         return jsonify({"status": "healthy"}), 200
 
     # --- Error handlers (consistent JSON) ---
@@ -77,7 +84,8 @@ def create_app() -> Flask:
     # --- Simple request logging ---
     @app.before_request
     def _log_request():
-        app.logger.info("%s %s", request.method, request.path)
+        if app.logger.isEnabledFor(logging.INFO):
+            app.logger.info("%s %s", request.method, request.path)
 
     # --- Register blueprints ---
     app.register_blueprint(tasks_bp)
@@ -85,6 +93,7 @@ def create_app() -> Flask:
     app.register_blueprint(users_bp)
     app.register_blueprint(dopamine_logs_bp)
     app.register_blueprint(bootstrap_bp)
+    app.register_blueprint(dopamine_bp)
 
 
     return app
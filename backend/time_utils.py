@@ -0,0 +1,26 @@
+# backend/time_utils.py
+# Query-string timestamp parsing shared by the list/summary endpoints.
+from __future__ import annotations
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Optional
+
+def parse_iso(s: Optional[str]) -> Optional[datetime]:
+    """
+    'YYYY-MM-DD' (midnight UTC) or ISO 8601, coerced to UTC; None if empty or invalid.
+    """
+    if not s or not isinstance(s, str):  # JSON bodies can carry anything here
+        return None
+    return _parse_iso_str(s)
+
+@lru_cache(maxsize=1024)  # polling clients send the same start/end strings repeatedly
+def _parse_iso_str(s: str) -> Optional[datetime]:
+    try:
+        if len(s) == 10 and s.count("-") == 2:
+            return datetime.fromisoformat(s).replace(tzinfo=timezone.utc)
+        if s[-1] == "Z":  # the common shape; skip the replace() + offset conversion
+            dt = datetime.fromisoformat(s[:-1])
+            return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else None
+        return datetime.fromisoformat(s).astimezone(timezone.utc)
+    except ValueError:
+        return None